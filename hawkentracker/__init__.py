@@ -23,6 +23,10 @@ def create_app(config_filename=None, config_parameters=None):
     from hawkentracker.database import db
     db.init_app(app)
 
+    # Save the API token when done
+    from hawkentracker.interface import teardown_api
+    app.teardown_appcontext(teardown_api)
+
     # Use app context while setting up session and views
     with app.app_context():
         # Setup views
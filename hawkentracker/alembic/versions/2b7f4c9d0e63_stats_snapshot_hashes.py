@@ -0,0 +1,36 @@
+"""Stats snapshot hashes
+
+Revision ID: 2b7f4c9d0e63
+Revises: 5c2d8e7a1f94
+Create Date: 2026-10-17 14:37:52.102846
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "2b7f4c9d0e63"
+down_revision = "5c2d8e7a1f94"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # Add snapshot hash to player stats
+    # Existing snapshots are left without a hash, so the first update afterwards records a snapshot for everyone
+    op.add_column("player_stats", sa.Column("stats_hash", sa.String(32)))
+
+    # Add skipped snapshot count to update journal
+    op.add_column("updates", sa.Column("snapshots_skipped", sa.Integer, nullable=False, server_default="0"))
+
+    # Remove server defaults (default is to populate the fields initially)
+    op.alter_column("updates", "snapshots_skipped", server_default=None)
+
+
+def downgrade():
+    # Remove skipped snapshot count from update journal
+    op.drop_column("updates", "snapshots_skipped")
+
+    # Remove snapshot hash from player stats
+    op.drop_column("player_stats", "stats_hash")
@@ -0,0 +1,26 @@
+"""Update checkpoint value
+
+Revision ID: 3d8f6a2c9e15
+Revises: 7a41e6c3b8d5
+Create Date: 2026-10-17 16:48:09.204417
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "3d8f6a2c9e15"
+down_revision = "7a41e6c3b8d5"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # Add the window boundary to resume from to the update journal
+    op.add_column("updates", sa.Column("checkpoint_value", sa.DateTime))
+
+
+def downgrade():
+    # Remove the window boundary from the update journal
+    op.drop_column("updates", "checkpoint_value")
@@ -0,0 +1,31 @@
+"""Player region counts
+
+Revision ID: 5c2d8e7a1f94
+Revises: e1f3b09c4a27
+Create Date: 2026-10-17 13:02:19.584410
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "5c2d8e7a1f94"
+down_revision = "e1f3b09c4a27"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # Create player region counts
+    # The counts are populated by running tracker-cli.py backfill-regions after upgrading
+    op.create_table("player_region_counts",
+        sa.Column("player_id", sa.String(36), sa.ForeignKey("players.player_id"), primary_key=True),
+        sa.Column("region", sa.String, primary_key=True),
+        sa.Column("matches", sa.Integer, nullable=False)
+    )
+
+
+def downgrade():
+    # Drop player region counts
+    op.drop_table("player_region_counts")
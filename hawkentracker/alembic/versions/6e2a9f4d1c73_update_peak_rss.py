@@ -0,0 +1,26 @@
+"""Update peak RSS
+
+Revision ID: 6e2a9f4d1c73
+Revises: 9c4e1b7d2a58
+Create Date: 2026-10-17 18:03:12.775190
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "6e2a9f4d1c73"
+down_revision = "9c4e1b7d2a58"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # Add peak memory usage to update journal
+    op.add_column("updates", sa.Column("peak_rss", sa.Integer))
+
+
+def downgrade():
+    # Remove peak memory usage from update journal
+    op.drop_column("updates", "peak_rss")
@@ -0,0 +1,48 @@
+"""Player latest stats
+
+Revision ID: 7a41e6c3b8d5
+Revises: 2b7f4c9d0e63
+Create Date: 2026-10-17 16:05:31.771290
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "7a41e6c3b8d5"
+down_revision = "2b7f4c9d0e63"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+# Needed tables
+player_stats = sa.sql.table("player_stats",
+    sa.Column("player_id", sa.String(36)),
+    sa.Column("snapshot_taken", sa.DateTime)
+)
+
+player_latest_stats = sa.sql.table("player_latest_stats",
+    sa.Column("player_id", sa.String(36)),
+    sa.Column("snapshot_taken", sa.DateTime)
+)
+
+
+def upgrade():
+    # Create latest stats pointers
+    op.create_table("player_latest_stats",
+        sa.Column("player_id", sa.String(36), sa.ForeignKey("players.player_id"), primary_key=True),
+        sa.Column("snapshot_taken", sa.DateTime, nullable=False)
+    )
+
+    # Point every player at their latest snapshot
+    op.execute(
+        player_latest_stats.insert().from_select(
+            ["player_id", "snapshot_taken"],
+            sa.select([player_stats.c.player_id, sa.func.max(player_stats.c.snapshot_taken)]).group_by(player_stats.c.player_id)
+        )
+    )
+
+
+def downgrade():
+    # Drop latest stats pointers
+    op.drop_table("player_latest_stats")
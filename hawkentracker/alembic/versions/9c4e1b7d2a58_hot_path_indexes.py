@@ -0,0 +1,40 @@
+"""Hot path indexes
+
+Revision ID: 9c4e1b7d2a58
+Revises: 3d8f6a2c9e15
+Create Date: 2026-10-17 17:21:46.018352
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "9c4e1b7d2a58"
+down_revision = "3d8f6a2c9e15"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # Index last seen, which the update windows are taken over
+    op.create_index("ix_players_last_seen", "players", ["last_seen"])
+    op.create_index("ix_matches_last_seen", "matches", ["last_seen"])
+
+    # Index the latest snapshot times for the incremental rankings
+    op.create_index("ix_player_latest_stats_snapshot_taken", "player_latest_stats", ["snapshot_taken"])
+
+    # Index the blacklisted players, which are a tiny fraction of all players
+    op.create_index("ix_players_blacklisted", "players", ["player_id"], postgresql_where=sa.text("blacklisted"))
+
+    # Index a player's matches by when they were seen, for the player match list
+    op.create_index("ix_match_players_player_id_last_seen", "match_players", ["player_id", "last_seen"])
+
+
+def downgrade():
+    # Drop the indexes
+    op.drop_index("ix_match_players_player_id_last_seen", table_name="match_players")
+    op.drop_index("ix_players_blacklisted", table_name="players")
+    op.drop_index("ix_player_latest_stats_snapshot_taken", table_name="player_latest_stats")
+    op.drop_index("ix_matches_last_seen", table_name="matches")
+    op.drop_index("ix_players_last_seen", table_name="players")
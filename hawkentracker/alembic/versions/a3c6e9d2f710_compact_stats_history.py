@@ -0,0 +1,34 @@
+"""Compact stats history
+
+Revision ID: a3c6e9d2f710
+Revises: f4b8e2a6c091
+Create Date: 2026-10-17 21:04:38.219655
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "a3c6e9d2f710"
+down_revision = "f4b8e2a6c091"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    # Create the compact stats history
+    # Snapshots are moved into it by running tracker-cli.py compact-history
+    op.create_table("player_stats_history",
+        sa.Column("player_id", postgresql.UUID, sa.ForeignKey("players.player_id"), primary_key=True),
+        sa.Column("snapshot_count", sa.Integer, nullable=False),
+        sa.Column("first_snapshot", sa.DateTime, nullable=False),
+        sa.Column("last_snapshot", sa.DateTime, nullable=False),
+        sa.Column("data", sa.LargeBinary, nullable=False)
+    )
+
+
+def downgrade():
+    # Drop the compact stats history (the compacted snapshots are lost)
+    op.drop_table("player_stats_history")
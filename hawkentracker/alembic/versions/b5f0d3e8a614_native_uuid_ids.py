@@ -0,0 +1,57 @@
+"""Native UUID ids
+
+Revision ID: b5f0d3e8a614
+Revises: 6e2a9f4d1c73
+Create Date: 2026-10-17 18:47:30.129865
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "b5f0d3e8a614"
+down_revision = "6e2a9f4d1c73"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def referencing_keys(table, column):
+    # Find every foreign key against the column, as their names vary with the history of the database
+    inspector = sa.inspect(op.get_bind())
+    keys = []
+    for source in inspector.get_table_names():
+        for key in inspector.get_foreign_keys(source):
+            if key["referred_table"] == table and key["referred_columns"] == [column]:
+                keys.append((key["name"], source, key["constrained_columns"][0]))
+
+    return keys
+
+
+def convert_ids(table, column, type_, using):
+    keys = referencing_keys(table, column)
+
+    # Drop the foreign keys, so the column and the columns referencing it can change type together
+    for name, source, source_column in keys:
+        op.drop_constraint(name, source, type_="foreignkey")
+
+    # Convert the columns (the indexes on them are rebuilt with the new type)
+    for source, source_column in [(table, column)] + [(source, source_column) for _, source, source_column in keys]:
+        op.execute("ALTER TABLE {0} ALTER COLUMN {1} TYPE {2} USING {3}".format(source, source_column, type_,
+                                                                                using.format(source_column)))
+
+    # Recreate the foreign keys
+    for name, source, source_column in keys:
+        op.create_foreign_key(name, source, table, [source_column], [column])
+
+
+def upgrade():
+    # Store player and match ids as native UUIDs (match ids are UUIDs without hyphens, which postgres accepts as input)
+    convert_ids("players", "player_id", "uuid", "{0}::uuid")
+    convert_ids("matches", "match_id", "uuid", "{0}::uuid")
+
+
+def downgrade():
+    # Store player and match ids as strings
+    convert_ids("matches", "match_id", "varchar(32)", "replace({0}::text, '-', '')")
+    convert_ids("players", "player_id", "varchar(36)", "{0}::text")
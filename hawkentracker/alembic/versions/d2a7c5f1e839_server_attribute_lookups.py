@@ -0,0 +1,52 @@
+"""Server attribute lookups
+
+Revision ID: d2a7c5f1e839
+Revises: b5f0d3e8a614
+Create Date: 2026-10-17 19:34:52.640173
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "d2a7c5f1e839"
+down_revision = "b5f0d3e8a614"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+# Server attribute, lookup table, id column, value column
+lookups = (
+    ("server_name", "server_names", "name_id", "name"),
+    ("server_region", "server_regions", "region_id", "region"),
+    ("server_gametype", "server_gametypes", "gametype_id", "gametype"),
+    ("server_map", "server_maps", "map_id", "map"),
+    ("server_version", "server_versions", "version_id", "version")
+)
+
+
+def upgrade():
+    for attribute, table, id_column, value_column in lookups:
+        # Create the lookup table from the values seen so far
+        op.create_table(table,
+            sa.Column(id_column, sa.SmallInteger, primary_key=True),
+            sa.Column(value_column, sa.String, nullable=False, unique=True)
+        )
+        op.execute("INSERT INTO {0} ({1}) SELECT DISTINCT {2} FROM matches ORDER BY {2}".format(table, value_column, attribute))
+
+        # Replace the match column with the id of it's value
+        op.add_column("matches", sa.Column(attribute + "_id", sa.SmallInteger))
+        op.execute("UPDATE matches SET {0}_id = {1}.{2} FROM {1} WHERE matches.{0} = {1}.{3}".format(attribute, table, id_column, value_column))
+        op.alter_column("matches", attribute + "_id", nullable=False)
+        op.create_foreign_key("matches_{0}_id_fkey".format(attribute), "matches", table, [attribute + "_id"], [id_column])
+        op.drop_column("matches", attribute)
+
+
+def downgrade():
+    for attribute, table, id_column, value_column in reversed(lookups):
+        # Put the values back onto the matches
+        op.add_column("matches", sa.Column(attribute, sa.String))
+        op.execute("UPDATE matches SET {0} = {1}.{3} FROM {1} WHERE matches.{0}_id = {1}.{2}".format(attribute, table, id_column, value_column))
+        op.alter_column("matches", attribute, nullable=False)
+        op.drop_column("matches", attribute + "_id")
+        op.drop_table(table)
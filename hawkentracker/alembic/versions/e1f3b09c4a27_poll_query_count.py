@@ -0,0 +1,26 @@
+"""Poll query count
+
+Revision ID: e1f3b09c4a27
+Revises: 4810939400a
+Create Date: 2026-10-17 10:12:44.318207
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "e1f3b09c4a27"
+down_revision = "4810939400a"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # Add query count to poll journal
+    op.add_column("polls", sa.Column("queries", sa.Integer))
+
+
+def downgrade():
+    # Remove query count from poll journal
+    op.drop_column("polls", "queries")
@@ -0,0 +1,88 @@
+"""Partition player stats
+
+Revision ID: f4b8e2a6c091
+Revises: d2a7c5f1e839
+Create Date: 2026-10-17 20:26:13.447951
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "f4b8e2a6c091"
+down_revision = "d2a7c5f1e839"
+branch_labels = None
+depends_on = None
+
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+# Needed tables
+player_stats_partitions = sa.sql.table("player_stats_partitions",
+    sa.Column("name", sa.String),
+    sa.Column("range_start", sa.DateTime),
+    sa.Column("range_end", sa.DateTime),
+    sa.Column("resolution", sa.String)
+)
+
+
+def index_definitions(table):
+    # Postgres gives back the statements to recreate the indexes, which also works for partitioned tables
+    return [(name, definition.replace(" ON ONLY ", " ON ")) for name, definition in op.get_bind().execute(
+        sa.text("SELECT indexname, indexdef FROM pg_indexes WHERE tablename = :table AND indexname NOT LIKE '%pkey'"), table=table
+    )]
+
+
+def upgrade():
+    # Requires postgres 11 or later, for indexes and foreign keys on partitioned tables
+    now = datetime.utcnow()
+    boundary = datetime(now.year + 1, 1, 1) if now.month == 12 else datetime(now.year, now.month + 1, 1)
+    indexes = index_definitions("player_stats")
+    pk = sa.inspect(op.get_bind()).get_pk_constraint("player_stats")["name"]
+
+    # Move the current snapshots out of the way, renaming their indexes so the partitioned table can use the names
+    op.rename_table("player_stats", "player_stats_archive")
+    op.execute("ALTER TABLE player_stats_archive RENAME CONSTRAINT {0} TO player_stats_archive_pkey".format(pk))
+    for name, _ in indexes:
+        op.execute("ALTER INDEX {0} RENAME TO {1}".format(name, name.replace("player_stats", "player_stats_archive", 1)))
+
+    # Create the partitioned table
+    op.execute("CREATE TABLE player_stats (LIKE player_stats_archive INCLUDING DEFAULTS) PARTITION BY RANGE (snapshot_taken)")
+    op.create_primary_key("player_stats_pkey", "player_stats", ["player_id", "snapshot_taken"])
+    op.create_foreign_key("player_stats_player_id_fkey", "player_stats", "players", ["player_id"], ["player_id"])
+    for _, definition in indexes:
+        op.execute(definition)
+
+    # Attach the current snapshots as a single partition up to next month, with a default partition for the rest
+    # Monthly partitions are created from then on by the updates and tracker-cli.py maintain-stats
+    op.execute("ALTER TABLE player_stats ATTACH PARTITION player_stats_archive FOR VALUES FROM (MINVALUE) TO ('{0}')".format(boundary.isoformat()))
+    op.execute("CREATE TABLE player_stats_default PARTITION OF player_stats DEFAULT")
+
+    # Track the partitions
+    op.create_table("player_stats_partitions",
+        sa.Column("name", sa.String, primary_key=True),
+        sa.Column("range_start", sa.DateTime),
+        sa.Column("range_end", sa.DateTime, nullable=False),
+        sa.Column("resolution", sa.String, nullable=False)
+    )
+    op.bulk_insert(player_stats_partitions, [
+        {"name": "player_stats_archive", "range_start": None, "range_end": boundary, "resolution": "full"}
+    ])
+
+
+def downgrade():
+    indexes = index_definitions("player_stats")
+    pk = sa.inspect(op.get_bind()).get_pk_constraint("player_stats")["name"]
+
+    # Copy every snapshot back into a plain table
+    op.execute("CREATE TABLE player_stats_unpartitioned (LIKE player_stats INCLUDING DEFAULTS)")
+    op.execute("INSERT INTO player_stats_unpartitioned SELECT * FROM player_stats")
+    op.execute("DROP TABLE player_stats")
+    op.rename_table("player_stats_unpartitioned", "player_stats")
+    op.create_primary_key(pk, "player_stats", ["player_id", "snapshot_taken"])
+    op.create_foreign_key("player_stats_player_id_fkey", "player_stats", "players", ["player_id"], ["player_id"])
+    for _, definition in indexes:
+        op.execute(definition)
+
+    # Drop partition tracking
+    op.drop_table("player_stats_partitions")
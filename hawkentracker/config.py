@@ -33,8 +33,24 @@ class DefaultSettings:
     HAWKEN_API_ATTEMPTS = 1
     HAWKEN_API_TIMEOUT = 15
     TRACKER_BATCH_SIZE = 500
+    TRACKER_PREFETCH_WINDOWS = 0
+    TRACKER_PREFETCH_WORKERS = 2
     MATCH_STATS_THRESHOLD = 2
+    STATS_DAILY_AFTER = 30
+    STATS_WEEKLY_AFTER = 365
+    STATS_KEEP_DETACHED = False
+    STATS_COMPACT_AFTER = 90
+    EXPORT_PATH = "export"
+    EXPORT_CHUNK_SIZE = 1000000
+    IMPORT_BATCH_SIZE = 50000
     RANK_PERCENT_THRESHOLD = 0.01
+    RANKING_BACKEND = "hash"
+    RANKING_METHOD = "query"
+    RANKING_WORKERS = 0
+    RANKING_INCREMENTAL = False
+    RANKING_REBUILD_INTERVAL = 86400
+    DAEMON_POLL_INTERVAL = 60
+    DAEMON_UPDATE_INTERVAL = None
 
 
 def parse_env_value(value):
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# Hawken Tracker - Daemon
+
+import time
+import signal
+import logging
+import threading
+
+from flask import current_app
+
+from hawkentracker.database import db, UpdateJournal
+from hawkentracker.mappings import UpdateFlag, UpdateStatus
+from hawkentracker.interface import save_api_token
+from hawkentracker.tracker import poll_servers, update_tracker
+
+logger = logging.getLogger(__name__)
+
+
+class TrackerDaemon:
+    """Runs polls (and optionally updates) on a fixed schedule within a single long-running app context.
+
+    Updates run in a thread of their own (with their own app context), so polling carries on while an update runs, as it
+    did when both were run from cron. The database engine, redis connection and API client are kept for the lifetime of
+    the daemon.
+
+    When stopped, a running update is stopped at the end of its current stage and marked as failed. A failed update
+    (stopped or not, including one from before the daemon started) is resumed by the next scheduled update, once; if the
+    resumed run fails again a new update is started the time after.
+    A stage can take several minutes on a large database, so give the daemon a stop timeout (systemd's TimeoutStopSec)
+    longer than the longest update stage, or the update is killed and left in progress."""
+    def __init__(self, poll_interval, update_interval=None, poll_flags=None, update_flags=None):
+        self.poll_interval = poll_interval
+        self.update_interval = update_interval
+        self.poll_flags = poll_flags or []
+        self.update_flags = update_flags or []
+        self.running = False
+        self.stopping = threading.Event()
+        self.update_thread = None
+        self.resumed = None
+
+    def stop(self, signum, frame):
+        logger.info("[Daemon] Received signal %d, stopping after the current task", signum)
+        self.running = False
+        self.stopping.set()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.running = True
+        self.stopping.clear()
+        app = current_app._get_current_object()
+
+        # Schedule against a monotonic clock, so the task runtime does not shift later runs
+        now = time.monotonic()
+        next_poll = now
+        next_update = now if self.update_interval else None
+
+        logger.info("[Daemon] Started")
+        while self.running:
+            if time.monotonic() >= next_poll:
+                self.run_task("Poll", lambda: poll_servers(list(self.poll_flags)))
+                next_poll = self.next_run("Poll", next_poll, self.poll_interval)
+
+            if self.running and next_update is not None and time.monotonic() >= next_update:
+                if self.update_thread is not None and self.update_thread.is_alive():
+                    logger.warn("[Daemon] Update still running, skipping this run")
+                else:
+                    self.update_thread = threading.Thread(target=self.run_update, args=(app,), name="update")
+                    self.update_thread.start()
+                next_update = self.next_run("Update", next_update, self.update_interval)
+
+            if next_update is None:
+                self.wait(next_poll - time.monotonic())
+            else:
+                self.wait(min(next_poll, next_update) - time.monotonic())
+
+        if self.update_thread is not None and self.update_thread.is_alive():
+            logger.info("[Daemon] Waiting for the update to stop at the end of its current stage")
+            self.update_thread.join()
+
+        logger.info("[Daemon] Stopped")
+
+    def run_update(self, app):
+        with app.app_context():
+            flags = list(self.update_flags)
+
+            # Resume a failed update where it left off, unless it already failed after being resumed
+            last = UpdateJournal.last()
+            if last is not None and last.status == UpdateStatus.failed and last.start != self.resumed:
+                logger.info("[Daemon] Resuming the update started at %s", last.start)
+                flags.append(UpdateFlag.resume)
+                self.resumed = last.start
+
+            self.run_task("Update", lambda: update_tracker(flags, stop=self.stopping))
+
+    def run_task(self, name, task):
+        logger.info("[Daemon] %s starting", name)
+        try:
+            journal = task()
+        except:
+            logger.error("[Daemon] %s raised an exception", name, exc_info=True)
+        else:
+            logger.info("[Daemon] %s finished with status %s", name, journal.status.name)
+        finally:
+            # Drop the session state between runs (the connection pool is kept) and persist the API token
+            db.session.remove()
+            save_api_token()
+
+    @staticmethod
+    def next_run(name, scheduled, interval):
+        next_scheduled = scheduled + interval
+
+        # Skip any runs that were missed while the task was running
+        now = time.monotonic()
+        if next_scheduled <= now:
+            missed = int((now - next_scheduled) // interval) + 1
+            logger.warn("[Daemon] %s overran its interval, skipping %d run(s)", name, missed)
+            next_scheduled += missed * interval
+
+        return next_scheduled
+
+    def wait(self, seconds):
+        # Sleep in short steps so a stop signal is handled promptly
+        end = time.monotonic() + seconds
+        while self.running:
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, 1))
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# Hawken Tracker - Compact stats history encoding
+
+import json
+import zlib
+import struct
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import numpy
+
+history_magic = b"HTSH"
+history_version = 1
+header_format = "<4sI"
+epoch = datetime(1970, 1, 1)
+microsecond = timedelta(microseconds=1)
+
+# Snapshot types by column set, so each set is only built once
+snapshot_types = {}
+
+
+def snapshot_type(columns):
+    columns = tuple(columns)
+    if columns not in snapshot_types:
+        snapshot_types[columns] = namedtuple("StatsSnapshot", ("snapshot_taken",) + columns)
+    return snapshot_types[columns]
+
+
+def delta_encode(values):
+    # Counters only grow by a little between snapshots, so the deltas are mostly small and compress well
+    deltas = values.copy()
+    deltas[:, 1:] = numpy.diff(values, axis=1)
+    return deltas
+
+
+def xor_encode(values):
+    # Unchanged floats xor to zero against the previous snapshot
+    bits = values.view("<u8")
+    xored = bits.copy()
+    xored[:, 1:] = numpy.bitwise_xor(bits[:, 1:], bits[:, :-1])
+    return xored
+
+
+def encode_history(snapshots, int_columns, float_columns):
+    """Encode snapshots (anything with the stats columns as attributes, in time order) into a compact history.
+
+    The history is a header naming the columns, followed by a zlib compressed body of the delta encoded snapshot times
+    and integer columns, the xor encoded float columns, and a bitmask of the null values."""
+    count = len(snapshots)
+    columns = list(int_columns) + list(float_columns)
+
+    def column_values(column):
+        return [getattr(snapshot, column, None) for snapshot in snapshots]
+
+    times = numpy.array([[(snapshot.snapshot_taken - epoch) // microsecond for snapshot in snapshots]], dtype="<i8")
+    nulls = numpy.array([[value is None for value in column_values(column)] for column in columns], dtype=bool)
+    ints = numpy.array([[value or 0 for value in column_values(column)] for column in int_columns], dtype="<i8").reshape(len(int_columns), count)
+    floats = numpy.array([[numpy.nan if value is None else value for value in column_values(column)] for column in float_columns],
+                         dtype="<f8").reshape(len(float_columns), count)
+
+    header = json.dumps({
+        "version": history_version,
+        "count": count,
+        "ints": list(int_columns),
+        "floats": list(float_columns)
+    }).encode("utf-8")
+    body = b"".join((delta_encode(times).tobytes(), delta_encode(ints).tobytes(), xor_encode(floats).tobytes(),
+                     numpy.packbits(nulls).tobytes()))
+
+    return struct.pack(header_format, history_magic, len(header)) + header + zlib.compress(body)
+
+
+def decode_history(data):
+    """Decode a compact history into a list of snapshots, with the same attribute names as the stats columns."""
+    magic, header_length = struct.unpack_from(header_format, data)
+    if magic != history_magic:
+        raise ValueError("Not a compact stats history")
+
+    offset = struct.calcsize(header_format)
+    header = json.loads(bytes(data[offset:offset + header_length]).decode("utf-8"))
+    if header["version"] != history_version:
+        raise ValueError("Unsupported compact stats history version {0}".format(header["version"]))
+
+    count = header["count"]
+    int_columns = header["ints"]
+    float_columns = header["floats"]
+    columns = int_columns + float_columns
+    body = zlib.decompress(bytes(data[offset + header_length:]))
+
+    # Split the body back up
+    position = 0
+
+    def take(dtype, rows):
+        nonlocal position
+        values = numpy.frombuffer(body, dtype=dtype, count=rows * count, offset=position).reshape(rows, count)
+        position += values.nbytes
+        return values
+
+    times = numpy.cumsum(take("<i8", 1), axis=1)[0]
+    ints = numpy.cumsum(take("<i8", len(int_columns)), axis=1)
+    floats = numpy.bitwise_xor.accumulate(take("<u8", len(float_columns)), axis=1).view("<f8")
+    nulls = numpy.unpackbits(numpy.frombuffer(body, dtype=numpy.uint8, offset=position))[:len(columns) * count].\
+        reshape(len(columns), count).astype(bool)
+
+    # Build the snapshots
+    values = ints.tolist() + floats.tolist()
+    nulls = nulls.tolist()
+    snapshot = snapshot_type(columns)
+    return [snapshot(epoch + timedelta(microseconds=times[i].item()),
+                     *[None if nulls[column][i] else values[column][i] for column in range(len(columns))])
+            for i in range(count)]
+
+
+class CompactHistory:
+    """A compact stats history, decoded the first time the snapshots are used."""
+    def __init__(self, data):
+        self.data = data
+        self._snapshots = None
+
+    @property
+    def snapshots(self):
+        if self._snapshots is None:
+            self._snapshots = decode_history(self.data)
+        return self._snapshots
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def __iter__(self):
+        return iter(self.snapshots)
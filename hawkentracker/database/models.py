@@ -1,36 +1,40 @@
 # -*- coding: utf-8 -*-
 # Hawken Tracker - Database Models
 
-import statistics
+import hashlib
 from datetime import datetime
 
+from sqlalchemy import event
 from sqlalchemy.dialects import postgres
 
 from hawkentracker.database import db
-from hawkentracker.database.util import NativeIntEnum, NativeStringEnum
-from hawkentracker.mappings import PollFlag, PollStatus, PollStage, UpdateFlag, UpdateStatus, UpdateStage
+from hawkentracker.database.history import CompactHistory, encode_history
+from hawkentracker.database.util import NativeIntEnum, NativeStringEnum, UUIDString, LookupCache
+from hawkentracker.mappings import PollFlag, PollStatus, PollStage, UpdateFlag, UpdateStatus, UpdateStage, StatsResolution,\
+    region_groupings, region_names, gametype_names, map_names
 
-__all__ = ["Player", "PlayerStats", "Match", "MatchPlayer", "PollJournal", "UpdateJournal"]
+__all__ = ["Player", "PlayerStats", "PlayerStatsPartition", "PlayerStatsHistory", "PlayerLatestStats", "PlayerRegionCount", "ServerName", "ServerRegion", "ServerGametype",
+           "ServerMap", "ServerVersion", "Match", "MatchPlayer", "PollJournal", "UpdateJournal", "server_lookups"]
 
 
 class Player(db.Model):
     __tablename__ = "players"
-    __table_args__ = (
-        db.Index("ix_players_callsign", db.func.lower("callsign"), unique=True),
-    )
 
-    player_id = db.Column(db.String(36), primary_key=True)
+    player_id = db.Column(UUIDString(), primary_key=True)
     callsign = db.Column(db.String)
     first_seen = db.Column(db.DateTime, nullable=False)
-    last_seen = db.Column(db.DateTime, nullable=False)
+    last_seen = db.Column(db.DateTime, nullable=False, index=True)
     common_region = db.Column(db.String)
     opt_out = db.Column(db.Boolean)
     blacklisted = db.Column(db.Boolean, default=False, nullable=False)
     blacklist_reason = db.Column(db.String)
 
     matches = db.relationship("MatchPlayer", order_by="MatchPlayer.last_seen", backref=db.backref("player", uselist=False))
-    stats = db.relationship("PlayerStats", uselist=False, order_by="PlayerStats.snapshot_taken")
+    stats = db.relationship("PlayerStats", secondary="player_latest_stats", uselist=False, viewonly=True,
+                            primaryjoin="Player.player_id == PlayerLatestStats.player_id",
+                            secondaryjoin="PlayerLatestStats.snapshot_join()")
     stats_history = db.relationship("PlayerStats", order_by="PlayerStats.snapshot_taken", backref=db.backref("player", uselist=False))
+    compact_history = db.relationship("PlayerStatsHistory", uselist=False, backref=db.backref("player", uselist=False))
 
     def seen(self, seen_time):
         if self.first_seen is None or self.first_seen > seen_time:
@@ -45,11 +49,29 @@ class Player(db.Model):
     def by_callsign(callsign):
         return Player.query.filter(db.func.lower(Player.callsign) == callsign.lower()).first()
 
+    def full_stats_history(self):
+        # Compacted snapshots first, as only snapshots older than the ones still in the stats table get compacted
+        history = []
+        if self.compact_history is not None:
+            history.extend(self.compact_history.snapshots)
+        history.extend(self.stats_history)
+
+        return history
+
+
+# Indexes against expressions of the player columns
+db.Index("ix_players_callsign", db.func.lower(Player.callsign), unique=True)
+db.Index("ix_players_blacklisted", Player.player_id, postgresql_where=Player.blacklisted)
+
 
 class PlayerStats(db.Model):
     __tablename__ = "player_stats"
+    __table_args__ = {
+        # Partitioned by time, see PlayerStatsPartition
+        "info": {"partition_by": "RANGE (snapshot_taken)"}
+    }
 
-    player_id = db.Column(db.String(36), db.ForeignKey("players.player_id"), primary_key=True, index=True)
+    player_id = db.Column(UUIDString(), db.ForeignKey("players.player_id"), primary_key=True, index=True)
     snapshot_taken = db.Column(db.DateTime, primary_key=True, index=True)
     mmr = db.Column(db.Float, index=True)
     pilot_level = db.Column(db.Integer, default=1, nullable=False, index=True)
@@ -105,11 +127,26 @@ class PlayerStats(db.Model):
     cooptdm_loss = db.Column(db.Integer, default=0, nullable=False)
     cooptdm_abandon = db.Column(db.Integer, default=0, nullable=False)
     cooptdm_win_loss = db.Column(db.Float, index=True)
+    stats_hash = db.Column(db.String(32))
+
+    _stats_keys = None
 
     def __repr__(self):
         return "<PlayerStats(player_id='{0}', snapshot_taken={1})>".format(self.player_id, self.snapshot_taken)
 
     def load_stats(self, stats):
+        for key, value in PlayerStats.map_stats(stats).items():
+            setattr(self, key, value)
+
+        self.calculate_hash()
+
+    @staticmethod
+    def map_stats(stats):
+        """Map a player's raw API stats to the stats column values, including the derived ratios.
+
+        Ranked values that don't meet the thresholds are left as None."""
+        row = dict.fromkeys(PlayerStats.stats_keys())
+
         # Filters
         default_mmr = (0.0, 1250.0, 1500.0)
         min_time = 36000  # 1 hour
@@ -118,124 +155,299 @@ class PlayerStats(db.Model):
         min_assists = 100
 
         # Unranked stats
-        self.kills = stats.get("Kills.Total", 0)
-        self.deaths = stats.get("Death.Total", 0)
-        self.assists = stats.get("Assist.Total", 0)
-        self.kill_steals = stats.get("Kills.Steal", 0)
-        self.critical_assists = stats.get("Assist.CriticalDamage", 0)
-        self.damage_in = stats.get("Damage.Sustained.Total", 0.0)
-        self.damage_out = stats.get("Damage.Dealt.Total", 0.0)
-        self.dm_total = stats.get("GameMode.DM.TotalMatches", 0)
-        self.dm_win = stats.get("GameMode.DM.Wins", 0)
-        self.dm_mvp = stats.get("GameMode.DM.MVP", 0)
-        self.dm_loss = stats.get("GameMode.DM.Losses", 0)
-        self.dm_abandon = stats.get("GameMode.DM.Abandonded", 0)
-        self.tdm_total = stats.get("GameMode.TDM.TotalMatches", 0)
-        self.tdm_win = stats.get("GameMode.TDM.Wins", 0)
-        self.tdm_loss = stats.get("GameMode.TDM.Losses", 0)
-        self.tdm_abandon = stats.get("GameMode.TDM.Abandonded", 0)
-        self.ma_total = stats.get("GameMode.MA.TotalMatches", 0)
-        self.ma_win = stats.get("GameMode.MA.Wins", 0)
-        self.ma_loss = stats.get("GameMode.MA.Losses", 0)
-        self.ma_abandon = stats.get("GameMode.MA.Abandonded", 0)
-        self.sg_total = stats.get("GameMode.SG.TotalMatches", 0)
-        self.sg_win = stats.get("GameMode.SG.Wins", 0)
-        self.sg_loss = stats.get("GameMode.SG.Losses", 0)
-        self.sg_abandon = stats.get("GameMode.SG.Abandonded", 0)
-        self.coop_total = stats.get("GameMode.CoOp.TotalMatches", 0)
-        self.coop_win = stats.get("GameMode.CoOp.Wins", 0)
-        self.coop_loss = stats.get("GameMode.CoOp.Losses", 0)
-        self.coop_abandon = stats.get("GameMode.CoOp.Abandonded", 0)
-        self.cooptdm_total = stats.get("GameMode.CoOpTDM.TotalMatches", 0)
-        self.cooptdm_win = stats.get("GameMode.CoOpTDM.Wins", 0)
-        self.cooptdm_loss = stats.get("GameMode.CoOpTDM.Losses", 0)
-        self.cooptdm_abandon = stats.get("GameMode.CoOpTDM.Abandonded", 0)
-        self.matches = min(stats.get("GameMode.All.TotalMatches", 0) - self.cooptdm_total, 0)
-        self.wins = min(stats.get("GameMode.All.Wins", 0) - self.cooptdm_win, 0)
-        self.losses = min(stats.get("GameMode.All.Losses", 0) - self.cooptdm_loss, 0)
-        self.abandons = min(stats.get("GameMode.All.Abandonded", 0) - self.cooptdm_abandon, 0)
+        row["kills"] = stats.get("Kills.Total", 0)
+        row["deaths"] = stats.get("Death.Total", 0)
+        row["assists"] = stats.get("Assist.Total", 0)
+        row["kill_steals"] = stats.get("Kills.Steal", 0)
+        row["critical_assists"] = stats.get("Assist.CriticalDamage", 0)
+        row["damage_in"] = stats.get("Damage.Sustained.Total", 0.0)
+        row["damage_out"] = stats.get("Damage.Dealt.Total", 0.0)
+        row["dm_total"] = stats.get("GameMode.DM.TotalMatches", 0)
+        row["dm_win"] = stats.get("GameMode.DM.Wins", 0)
+        row["dm_mvp"] = stats.get("GameMode.DM.MVP", 0)
+        row["dm_loss"] = stats.get("GameMode.DM.Losses", 0)
+        row["dm_abandon"] = stats.get("GameMode.DM.Abandonded", 0)
+        row["tdm_total"] = stats.get("GameMode.TDM.TotalMatches", 0)
+        row["tdm_win"] = stats.get("GameMode.TDM.Wins", 0)
+        row["tdm_loss"] = stats.get("GameMode.TDM.Losses", 0)
+        row["tdm_abandon"] = stats.get("GameMode.TDM.Abandonded", 0)
+        row["ma_total"] = stats.get("GameMode.MA.TotalMatches", 0)
+        row["ma_win"] = stats.get("GameMode.MA.Wins", 0)
+        row["ma_loss"] = stats.get("GameMode.MA.Losses", 0)
+        row["ma_abandon"] = stats.get("GameMode.MA.Abandonded", 0)
+        row["sg_total"] = stats.get("GameMode.SG.TotalMatches", 0)
+        row["sg_win"] = stats.get("GameMode.SG.Wins", 0)
+        row["sg_loss"] = stats.get("GameMode.SG.Losses", 0)
+        row["sg_abandon"] = stats.get("GameMode.SG.Abandonded", 0)
+        row["coop_total"] = stats.get("GameMode.CoOp.TotalMatches", 0)
+        row["coop_win"] = stats.get("GameMode.CoOp.Wins", 0)
+        row["coop_loss"] = stats.get("GameMode.CoOp.Losses", 0)
+        row["coop_abandon"] = stats.get("GameMode.CoOp.Abandonded", 0)
+        row["cooptdm_total"] = stats.get("GameMode.CoOpTDM.TotalMatches", 0)
+        row["cooptdm_win"] = stats.get("GameMode.CoOpTDM.Wins", 0)
+        row["cooptdm_loss"] = stats.get("GameMode.CoOpTDM.Losses", 0)
+        row["cooptdm_abandon"] = stats.get("GameMode.CoOpTDM.Abandonded", 0)
+        row["matches"] = min(stats.get("GameMode.All.TotalMatches", 0) - row["cooptdm_total"], 0)
+        row["wins"] = min(stats.get("GameMode.All.Wins", 0) - row["cooptdm_win"], 0)
+        row["losses"] = min(stats.get("GameMode.All.Losses", 0) - row["cooptdm_loss"], 0)
+        row["abandons"] = min(stats.get("GameMode.All.Abandonded", 0) - row["cooptdm_abandon"], 0)
 
         # Ranked stats
         mmr = stats.get("MatchMaking.Rating", 0.0)
         if mmr not in default_mmr:
-            self.mmr = mmr
+            row["mmr"] = mmr
 
-        self.pilot_level = stats.get("Progress.Pilot.Level", 1)
-        self.time_played = stats.get("TimePlayed", 0)
+        row["pilot_level"] = stats.get("Progress.Pilot.Level", 1)
+        row["time_played"] = stats.get("TimePlayed", 0)
 
-        if self.time_played >= min_time:
+        if row["time_played"] >= min_time:
             # XP
             xp = stats.get("ExpPoints", 0)
             if xp > 0:
-                self.xp = xp
-                self.xp_per_min = (self.xp / self.time_played) * 60
+                row["xp"] = xp
+                row["xp_per_min"] = (row["xp"] / row["time_played"]) * 60
 
             # HC
             hc = stats.get("HawkenPoints", 0)
             if hc > 0:
-                self.hc = hc
-                self.hc_per_min = (self.hc / self.time_played) * 60
+                row["hc"] = hc
+                row["hc_per_min"] = (row["hc"] / row["time_played"]) * 60
 
             # KDA
-            if self.kills >= min_kills and self.deaths > 0 and self.assists >= min_assists:
-                self.kda = (self.kills + self.assists) / self.deaths
+            if row["kills"] >= min_kills and row["deaths"] > 0 and row["assists"] >= min_assists:
+                row["kda"] = (row["kills"] + row["assists"]) / row["deaths"]
 
             # Kill steals
-            if self.kill_steals > 0 and self.kills >= min_kills:
-                self.kill_steal_ratio = self.kill_steals / self.kills
+            if row["kill_steals"] > 0 and row["kills"] >= min_kills:
+                row["kill_steal_ratio"] = row["kill_steals"] / row["kills"]
 
             # Critical assists
-            if self.critical_assists > 0 and self.assists >= min_assists:
-                self.critical_assist_ratio = self.critical_assists / self.assists
+            if row["critical_assists"] > 0 and row["assists"] >= min_assists:
+                row["critical_assist_ratio"] = row["critical_assists"] / row["assists"]
 
             # Damage
-            if self.damage_in > 0 and self.damage_out > 0:
-                self.damage_ratio = self.damage_out / self.damage_in
+            if row["damage_in"] > 0 and row["damage_out"] > 0:
+                row["damage_ratio"] = row["damage_out"] / row["damage_in"]
 
             # Deathmatch
-            if self.dm_total >= min_matches and self.dm_mvp > 0 and self.dm_loss + self.dm_abandon + (self.dm_win - self.dm_mvp) > 0:
-                self.dm_win_loss = self.dm_mvp / (self.dm_loss + self.dm_abandon + (self.dm_win - self.dm_mvp))
+            if row["dm_total"] >= min_matches and row["dm_mvp"] > 0 and row["dm_loss"] + row["dm_abandon"] + (row["dm_win"] - row["dm_mvp"]) > 0:
+                row["dm_win_loss"] = row["dm_mvp"] / (row["dm_loss"] + row["dm_abandon"] + (row["dm_win"] - row["dm_mvp"]))
 
             # Team Deathmatch
-            if self.tdm_total >= min_matches and self.tdm_win > 0 and self.tdm_loss + self.tdm_abandon > 0:
-                self.tdm_win_loss = self.tdm_win / (self.tdm_loss + self.tdm_abandon)
+            if row["tdm_total"] >= min_matches and row["tdm_win"] > 0 and row["tdm_loss"] + row["tdm_abandon"] > 0:
+                row["tdm_win_loss"] = row["tdm_win"] / (row["tdm_loss"] + row["tdm_abandon"])
 
             # Missile Assault
-            if self.ma_total >= min_matches and self.ma_win > 0 and self.ma_loss + self.ma_abandon > 0:
-                self.ma_win_loss = self.ma_win / (self.ma_loss + self.ma_abandon)
+            if row["ma_total"] >= min_matches and row["ma_win"] > 0 and row["ma_loss"] + row["ma_abandon"] > 0:
+                row["ma_win_loss"] = row["ma_win"] / (row["ma_loss"] + row["ma_abandon"])
 
             # Siege
-            if self.sg_total >= min_matches and self.sg_win > 0 and (self.sg_loss + self.sg_abandon) > 0:
-                self.sg_win_loss = self.sg_win / (self.sg_loss + self.sg_abandon)
+            if row["sg_total"] >= min_matches and row["sg_win"] > 0 and (row["sg_loss"] + row["sg_abandon"]) > 0:
+                row["sg_win_loss"] = row["sg_win"] / (row["sg_loss"] + row["sg_abandon"])
 
             # COBD
-            if self.coop_total >= min_matches and self.coop_win > 0 and self.coop_loss + self.coop_abandon > 0:
-                self.coop_win_loss = self.coop_win / (self.coop_loss + self.coop_abandon)
+            if row["coop_total"] >= min_matches and row["coop_win"] > 0 and row["coop_loss"] + row["coop_abandon"] > 0:
+                row["coop_win_loss"] = row["coop_win"] / (row["coop_loss"] + row["coop_abandon"])
 
             # Coop TDM
-            if self.cooptdm_total >= min_matches and self.cooptdm_win > 0 and self.cooptdm_loss + self.cooptdm_abandon > 0:
-                self.cooptdm_win_loss = self.cooptdm_win / (self.cooptdm_loss + self.cooptdm_abandon)
+            if row["cooptdm_total"] >= min_matches and row["cooptdm_win"] > 0 and row["cooptdm_loss"] + row["cooptdm_abandon"] > 0:
+                row["cooptdm_win_loss"] = row["cooptdm_win"] / (row["cooptdm_loss"] + row["cooptdm_abandon"])
 
             # All
-            if self.matches >= min_matches and self.wins > 0 and self.losses + self.abandons > 0:
-                self.win_loss = self.wins / (self.losses + self.abandons)
+            if row["matches"] >= min_matches and row["wins"] > 0 and row["losses"] + row["abandons"] > 0:
+                row["win_loss"] = row["wins"] / (row["losses"] + row["abandons"])
+
+        return row
+
+    def as_row(self):
+        # Column values with the defaults applied, for inserting with Core
+        row = {}
+        for column in self.__table__.columns:
+            value = getattr(self, column.key)
+            if value is None and column.default is not None:
+                value = column.default.arg
+            row[column.key] = value
+
+        return row
+
+    def calculate_hash(self):
+        self.stats_hash = PlayerStats.hash_stats({key: getattr(self, key) for key in PlayerStats.stats_keys()})
+
+    @staticmethod
+    def hash_stats(row):
+        # Hash of the loaded stats, used to detect unchanged snapshots
+        values = [row[key] for key in PlayerStats.stats_keys()]
+        return hashlib.md5(repr(values).encode("utf-8")).hexdigest()
+
+    @classmethod
+    def stats_keys(cls):
+        # Stats columns in table order, worked out once as it's used for every snapshot loaded
+        if cls._stats_keys is None:
+            cls._stats_keys = [column.key for column in cls.__table__.columns if column.key not in ("player_id", "snapshot_taken", "stats_hash")]
+        return cls._stats_keys
+
+    @classmethod
+    def stats_columns(cls):
+        # Integer and float stats columns, for the compact history
+        columns = [cls.__table__.columns[key] for key in cls.stats_keys()]
+        return ([column.key for column in columns if isinstance(column.type, db.Integer)],
+                [column.key for column in columns if isinstance(column.type, db.Float)])
+
+
+# Catch any snapshots outside of the time partitions
+event.listen(PlayerStats.__table__, "after_create", db.DDL("CREATE TABLE player_stats_default PARTITION OF player_stats DEFAULT"))
+
+
+class PlayerStatsPartition(db.Model):
+    __tablename__ = "player_stats_partitions"
+
+    name = db.Column(db.String, primary_key=True)
+    range_start = db.Column(db.DateTime)  # Unbounded if null
+    range_end = db.Column(db.DateTime, nullable=False)
+    resolution = db.Column(NativeStringEnum(StatsResolution), default=StatsResolution.full, nullable=False)
+
+    def __repr__(self):
+        return "<PlayerStatsPartition(name='{0}', resolution={1})>".format(self.name, self.resolution)
+
+    @staticmethod
+    def covering(time):
+        return PlayerStatsPartition.query.filter(db.or_(PlayerStatsPartition.range_start.is_(None), PlayerStatsPartition.range_start <= time)).\
+                                          filter(PlayerStatsPartition.range_end > time).first()
+
+
+class PlayerStatsHistory(db.Model):
+    __tablename__ = "player_stats_history"
+
+    player_id = db.Column(UUIDString(), db.ForeignKey("players.player_id"), primary_key=True)
+    snapshot_count = db.Column(db.Integer, nullable=False)
+    first_snapshot = db.Column(db.DateTime, nullable=False)
+    last_snapshot = db.Column(db.DateTime, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+    def __repr__(self):
+        return "<PlayerStatsHistory(player_id='{0}', snapshot_count={1})>".format(self.player_id, self.snapshot_count)
+
+    @property
+    def snapshots(self):
+        # Decoded on first use and kept with the instance until the data changes
+        if getattr(self, "_history", None) is None or self._history.data is not self.data:
+            self._history = CompactHistory(self.data)
+        return self._history.snapshots
+
+    def store(self, snapshots):
+        # Snapshots must be in time order
+        self.data = encode_history(snapshots, *PlayerStats.stats_columns())
+        self.snapshot_count = len(snapshots)
+        self.first_snapshot = snapshots[0].snapshot_taken
+        self.last_snapshot = snapshots[-1].snapshot_taken
+
+
+class PlayerLatestStats(db.Model):
+    __tablename__ = "player_latest_stats"
+
+    player_id = db.Column(UUIDString(), db.ForeignKey("players.player_id"), primary_key=True)
+    snapshot_taken = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return "<PlayerLatestStats(player_id='{0}', snapshot_taken={1})>".format(self.player_id, self.snapshot_taken)
+
+    @staticmethod
+    def snapshot_join():
+        return db.and_(PlayerLatestStats.player_id == PlayerStats.player_id,
+                       PlayerLatestStats.snapshot_taken == PlayerStats.snapshot_taken)
+
+
+class PlayerRegionCount(db.Model):
+    __tablename__ = "player_region_counts"
+
+    player_id = db.Column(UUIDString(), db.ForeignKey("players.player_id"), primary_key=True)
+    region = db.Column(db.String, primary_key=True)
+    matches = db.Column(db.Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return "<PlayerRegionCount(player_id='{0}', region='{1}', matches={2})>".format(self.player_id, self.region, self.matches)
+
+    @staticmethod
+    def group_region(region):
+        # SQL equivalent of region_groupings.get(region, region)
+        return db.case(region_groupings, value=region, else_=region)
+
+
+class ServerName(db.Model):
+    __tablename__ = "server_names"
+
+    name_id = db.Column(db.SmallInteger, primary_key=True)
+    name = db.Column(db.String, nullable=False, unique=True)
+
+    def __repr__(self):
+        return "<ServerName(name_id={0}, name='{1}')>".format(self.name_id, self.name)
+
+
+class ServerRegion(db.Model):
+    __tablename__ = "server_regions"
+
+    region_id = db.Column(db.SmallInteger, primary_key=True)
+    region = db.Column(db.String, nullable=False, unique=True)
+
+    def __repr__(self):
+        return "<ServerRegion(region_id={0}, region='{1}')>".format(self.region_id, self.region)
+
+
+class ServerGametype(db.Model):
+    __tablename__ = "server_gametypes"
+
+    gametype_id = db.Column(db.SmallInteger, primary_key=True)
+    gametype = db.Column(db.String, nullable=False, unique=True)
+
+    def __repr__(self):
+        return "<ServerGametype(gametype_id={0}, gametype='{1}')>".format(self.gametype_id, self.gametype)
+
+
+class ServerMap(db.Model):
+    __tablename__ = "server_maps"
+
+    map_id = db.Column(db.SmallInteger, primary_key=True)
+    map = db.Column(db.String, nullable=False, unique=True)
+
+    def __repr__(self):
+        return "<ServerMap(map_id={0}, map='{1}')>".format(self.map_id, self.map)
+
+
+class ServerVersion(db.Model):
+    __tablename__ = "server_versions"
+
+    version_id = db.Column(db.SmallInteger, primary_key=True)
+    version = db.Column(db.String, nullable=False, unique=True)
+
+    def __repr__(self):
+        return "<ServerVersion(version_id={0}, version='{1}')>".format(self.version_id, self.version)
+
+
+# Cached lookups for the server attributes of matches, by attribute
+server_lookups = {
+    "server_name": LookupCache(ServerName.__table__, "name_id", "name"),
+    "server_region": LookupCache(ServerRegion.__table__, "region_id", "region", region_names),
+    "server_gametype": LookupCache(ServerGametype.__table__, "gametype_id", "gametype", gametype_names),
+    "server_map": LookupCache(ServerMap.__table__, "map_id", "map", map_names),
+    "server_version": LookupCache(ServerVersion.__table__, "version_id", "version")
+}
 
 
 class Match(db.Model):
     __tablename__ = "matches"
 
-    match_id = db.Column(db.String(32), primary_key=True)
-    server_name = db.Column(db.String, nullable=False)
-    server_region = db.Column(db.String, nullable=False)
-    server_gametype = db.Column(db.String, nullable=False)
-    server_map = db.Column(db.String, nullable=False)
-    server_version = db.Column(db.String, nullable=False)
+    match_id = db.Column(UUIDString(hyphens=False), primary_key=True)
+    server_name_id = db.Column(db.SmallInteger, db.ForeignKey("server_names.name_id"), nullable=False)
+    server_region_id = db.Column(db.SmallInteger, db.ForeignKey("server_regions.region_id"), nullable=False)
+    server_gametype_id = db.Column(db.SmallInteger, db.ForeignKey("server_gametypes.gametype_id"), nullable=False)
+    server_map_id = db.Column(db.SmallInteger, db.ForeignKey("server_maps.map_id"), nullable=False)
+    server_version_id = db.Column(db.SmallInteger, db.ForeignKey("server_versions.version_id"), nullable=False)
     server_matchmaking = db.Column(db.Boolean)
     server_tournament = db.Column(db.Boolean)
     server_password_protected = db.Column(db.Boolean)
     server_mmr_ignored = db.Column(db.Boolean)
     first_seen = db.Column(db.DateTime, nullable=False)
-    last_seen = db.Column(db.DateTime, nullable=False)
+    last_seen = db.Column(db.DateTime, nullable=False, index=True)
     last_stats_update = db.Column(db.DateTime)
     pilot_level_avg = db.Column(db.Float)
     mmr_avg = db.Column(db.Float)
@@ -254,37 +466,56 @@ class Match(db.Model):
         if self.last_seen is None or self.last_seen < seen_time:
             self.last_seen = seen_time
 
+    @property
+    def server_name(self):
+        return server_lookups["server_name"].value(self.server_name_id)
+
+    @property
+    def server_region(self):
+        return server_lookups["server_region"].value(self.server_region_id)
+
+    @property
+    def server_gametype(self):
+        return server_lookups["server_gametype"].value(self.server_gametype_id)
+
+    @property
+    def server_map(self):
+        return server_lookups["server_map"].value(self.server_map_id)
+
+    @property
+    def server_version(self):
+        return server_lookups["server_version"].value(self.server_version_id)
+
+    def server_label(self, attribute):
+        return server_lookups[attribute].label(getattr(self, attribute + "_id"))
+
     def load_server_info(self, server):
-        self.server_name = server["ServerName"]
-        self.server_region = server["Region"]
-        self.server_gametype = server["GameType"]
-        self.server_map = server["Map"]
-        self.server_version = server["GameVersion"]
-
-        self.server_matchmaking = server["IsMatchmakingVisible"]
-        self.server_tournament = server["DeveloperData"].get("bTournament", "false").lower() == "true"
-        self.server_password_protected = len(server["DeveloperData"].get("PasswordHash", "")) > 0
-        self.server_mmr_ignored = server["DeveloperData"].get("bIgnoreMMR", "FALSE").lower() == "true"
-
-    def calculate_stats(self, mmrs, pilot_levels, update_time):
-        # Update stats
-        if len(mmrs) > 0:
-            self.mmr_avg = statistics.mean(mmrs)
-            self.mmr_min = min(mmrs)
-            self.mmr_max = max(mmrs)
-            if len(mmrs) > 1:
-                self.mmr_stddev = statistics.stdev(mmrs)
-        if len(pilot_levels) > 0:
-            self.pilot_level_avg = statistics.mean(pilot_levels)
-
-        self.last_stats_update = update_time
+        for key, value in Match.parse_server_info(server).items():
+            setattr(self, key, value)
+
+    @staticmethod
+    def parse_server_info(server):
+        return {
+            "server_name_id": server_lookups["server_name"].id(server["ServerName"]),
+            "server_region_id": server_lookups["server_region"].id(server["Region"]),
+            "server_gametype_id": server_lookups["server_gametype"].id(server["GameType"]),
+            "server_map_id": server_lookups["server_map"].id(server["Map"]),
+            "server_version_id": server_lookups["server_version"].id(server["GameVersion"]),
+            "server_matchmaking": server["IsMatchmakingVisible"],
+            "server_tournament": server["DeveloperData"].get("bTournament", "false").lower() == "true",
+            "server_password_protected": len(server["DeveloperData"].get("PasswordHash", "")) > 0,
+            "server_mmr_ignored": server["DeveloperData"].get("bIgnoreMMR", "FALSE").lower() == "true"
+        }
 
 
 class MatchPlayer(db.Model):
     __tablename__ = "match_players"
+    __table_args__ = (
+        db.Index("ix_match_players_player_id_last_seen", "player_id", "last_seen"),
+    )
 
-    match_id = db.Column(db.String(32), db.ForeignKey("matches.match_id"), index=True, primary_key=True)
-    player_id = db.Column(db.String(36), db.ForeignKey("players.player_id"), index=True, primary_key=True)
+    match_id = db.Column(UUIDString(hyphens=False), db.ForeignKey("matches.match_id"), index=True, primary_key=True)
+    player_id = db.Column(UUIDString(), db.ForeignKey("players.player_id"), index=True, primary_key=True)
     first_seen = db.Column(db.DateTime, nullable=False)
     last_seen = db.Column(db.DateTime, nullable=False)
 
@@ -311,6 +542,7 @@ class PollJournal(db.Model):
     players_added = db.Column(db.Integer)
     matches_updated = db.Column(db.Integer)
     matches_added = db.Column(db.Integer)
+    queries = db.Column(db.Integer)
 
     def stage_next(self, next_stage):
         self.stage = next_stage
@@ -352,10 +584,13 @@ class UpdateJournal(db.Model):
     stage = db.Column(NativeIntEnum(UpdateStage), default=UpdateStage.not_started, nullable=False)
     current_step = db.Column(db.Integer, default=0)
     total_steps = db.Column(db.Integer, default=0)
+    checkpoint_value = db.Column(db.DateTime)
     flags = db.Column(postgres.ARRAY(NativeStringEnum(UpdateFlag)), default=[], nullable=False)
     players_updated = db.Column(db.Integer, default=0, nullable=False)
     matches_updated = db.Column(db.Integer, default=0, nullable=False)
     callsigns_updated = db.Column(db.Integer, default=0, nullable=False)
+    snapshots_skipped = db.Column(db.Integer, default=0, nullable=False)
+    peak_rss = db.Column(db.Integer)
     global_rankings_updated = db.Column(db.Boolean, default=False, nullable=False)
 
     def stage_start(self, total):
@@ -375,13 +610,15 @@ class UpdateJournal(db.Model):
 
         return (self.current_step / self.total_steps) * 100
 
-    def stage_checkpoint(self, current):
+    def stage_checkpoint(self, current, value=None):
         self.current_step = current
+        self.checkpoint_value = value
         db.session.add(self)
 
     def stage_next(self, next_stage):
         self.current_step = None
         self.total_steps = None
+        self.checkpoint_value = None
         self.stage = next_stage
         db.session.add(self)
 
@@ -399,6 +636,7 @@ class UpdateJournal(db.Model):
         self.status = UpdateStatus.complete
         self.current_step = None
         self.total_steps = None
+        self.checkpoint_value = None
         db.session.add(self)
 
     def __repr__(self):
@@ -3,6 +3,7 @@
 
 import os
 import os.path
+import threading
 from contextlib import contextmanager
 from functools import wraps
 
@@ -10,7 +11,11 @@ import psycopg2
 import psycopg2.errorcodes
 from flask import current_app
 from flask.ext.sqlalchemy import get_debug_queries
+from sqlalchemy import event
+from sqlalchemy.dialects import postgres
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.schema import CreateTable
 
 from hawkentracker.database import db
 
@@ -33,60 +38,59 @@ def dump_queries(name):
 
 
 def column_windows(session, column, windowsize, begin=None, end=None):
-    """Return a series of WHERE clauses against
-    a given column that break it into windows.
+    """Generate WHERE clauses against a given column that break it into windows of about windowsize rows.
 
-    Result is an iterable of tuples, consisting of
-    ((start, end), whereclause), where (start, end) are the ids.
+    Each boundary is found as it is needed by seeking windowsize rows past the start of the window on the column's
+    index. Rows sharing a value are never split between windows, so a window can hold more than windowsize rows.
 
-    Requires a database that supports window functions,
-    i.e. Postgresql, SQL Server, Oracle."""
-    def window_size(window):
-        return session.query(db.func.count(column)).filter(window).one()[0]
+    Result is a generator of (whereclause, boundary) tuples, where boundary is the start of the following window (or end
+    for the last window)."""
+    def bounded(q):
+        if end is not None:
+            q = q.filter(column < end)
+        return q
 
-    # Base query
-    q = session.query(column, db.func.row_number().over(order_by=column).label("rownum")).from_self(column)
+    start = begin
+    while True:
+        # Find the start of the next window
+        q = session.query(column)
+        if start is not None:
+            q = q.filter(column >= start)
+        boundary = bounded(q).order_by(column).offset(windowsize).limit(1).scalar()
 
-    # Set window size
-    if windowsize > 1:
-        q = q.filter(db.text("rownum %% %d=1" % windowsize))
+        if boundary is not None and boundary == start:
+            # More than a window of rows share the start value, so take all of them and move onto the next value
+            boundary = bounded(session.query(db.func.min(column)).filter(column > start)).scalar()
 
-    # Range filters
-    if begin is not None:
-        q = q.filter(column >= begin)
-    if end is not None:
-        q = q.filter(column < end)
+        # Build the window
+        clauses = []
+        if start is not None:
+            clauses.append(column >= start)
+        if boundary is not None:
+            clauses.append(column < boundary)
+        elif end is not None:
+            clauses.append(column < end)
 
-    # Get intervals
-    intervals = [interval for interval, in q]
+        if boundary is None:
+            yield db.and_(*clauses) if clauses else db.true(), end
+            return
 
-    # Constrain intervals
-    if begin is not None:
-        intervals.insert(0, begin)
-    if end is not None:
-        intervals.append(end)
+        yield db.and_(*clauses), boundary
+        start = boundary
 
-    # Generate windows
-    windows = []
-    while intervals:
-        start = intervals.pop(0)
-        if len(intervals) > 0:
-            windows.append(db.and_(column >= start, column < intervals[0]))
-        elif end is None:
-            # Only emit if there is no ending point (otherwise the end of the range is not constrained)
-            windows.append(column >= start)
 
-    # Remove empty windows
-    if begin is not None and len(windows) >= 1 and window_size(windows[0]) == 0:
-        windows.pop(0)
-    if end is not None and len(windows) >= 1 and window_size(windows[-1]) == 0:
-        windows.pop()
+def windowed_query(q, column, windowsize, begin=None, end=None, streaming=False, chunk_commit=True, clear_session=False, journal=None,
+                   logger=None, logger_prefix=None, prefetch=None, prefetch_depth=1):
+    """"Break a Query into windows on a given column.
 
-    return windows
+    If clear_session is given, everything but the journal is removed from the session after each chunk is committed, so
+    the objects loaded for a window don't build up in the identity map over the whole query.
 
+    The journal is checkpointed with the boundary of each completed window, so a resumed stage carries on from the
+    first window that wasn't completed.
 
-def windowed_query(q, column, windowsize, begin=None, end=None, streaming=False, chunk_commit=True, journal=None, logger=None, logger_prefix=None):
-    """"Break a Query into windows on a given column."""
+    If prefetch is given, it is called with the index and query of each window up to prefetch_depth windows ahead of
+    the window being yielded, so work for upcoming windows can start before the current one is committed."""
 
     def format_log(msg):
         if logger_prefix is not None:
@@ -94,24 +98,51 @@ def windowed_query(q, column, windowsize, begin=None, end=None, streaming=False,
         return msg
 
     if logger is not None:
-        logger.debug(format_log("Generating windows..."))
+        logger.debug(format_log("Counting rows..."))
 
-    windows = column_windows(q.session, column, windowsize, begin=begin, end=end)
-    total_windows = len(windows)
+    # Estimate the number of windows for progress (shared values can make for fewer, larger windows)
+    count = q.session.query(db.func.count(column))
+    if begin is not None:
+        count = count.filter(column >= begin)
+    if end is not None:
+        count = count.filter(column < end)
+    total_windows = -(-count.scalar() // windowsize)
 
     if total_windows == 0:
         if logger is not None:
             logger.debug(format_log("No windows found."))
         return
     elif logger is not None:
-        logger.debug(format_log("%d total windows, iterating..."), total_windows)
+        logger.debug(format_log("About %d total windows, iterating..."), total_windows)
 
     i = 0
     if journal is not None:
         i = journal.stage_start(total_windows)
         q.session.commit()
 
-    for whereclause in windows[i:]:
+        # Resume from the last completed window
+        if journal.checkpoint_value is not None:
+            begin = journal.checkpoint_value
+
+    windows = column_windows(q.session, column, windowsize, begin=begin, end=end)
+    upcoming = []
+    next_index = i
+    while True:
+        # Find the current window, and any windows to prefetch
+        while len(upcoming) <= (prefetch_depth if prefetch is not None else 0):
+            window = next(windows, None)
+            if window is None:
+                break
+
+            if prefetch is not None:
+                prefetch(next_index, q.filter(window[0]).order_by(column))
+            upcoming.append(window)
+            next_index += 1
+
+        if len(upcoming) == 0:
+            break
+
+        whereclause, boundary = upcoming.pop(0)
         if streaming:
             for row in q.filter(whereclause).order_by(column):
                 yield i, row
@@ -122,15 +153,47 @@ def windowed_query(q, column, windowsize, begin=None, end=None, streaming=False,
         i += 1
 
         if journal is not None:
-            journal.stage_checkpoint(i)
+            journal.stage_checkpoint(i, boundary)
 
         if chunk_commit:
             if logger is not None:
                 logger.debug(format_log("Committing chunk %d"), i)
             q.session.commit()
 
+            if clear_session:
+                q.session.expunge_all()
+                if journal is not None:
+                    q.session.add(journal)
+
         if logger is not None:
-            logger.info(format_log("Chunk %d/%d complete"), i, total_windows)
+            logger.info(format_log("Chunk %d/%d complete"), i, max(i, total_windows))
+
+
+def create_staging_table(session, name, *columns):
+    """Create a temporary table for staging bulk writes.
+
+    The table is dropped when the transaction commits, or replaced if it is staged again in the same transaction."""
+    table = db.Table(name, db.MetaData(), *columns, prefixes=["TEMPORARY"], postgresql_on_commit="DROP")
+    session.execute("DROP TABLE IF EXISTS pg_temp.{0}".format(name))
+    table.create(bind=session.connection())
+
+    return table
+
+
+def bulk_insert(session, table, rows):
+    """Insert a list of rows using a single multi-row VALUES statement."""
+    if len(rows) == 0:
+        return 0
+
+    return session.execute(table.insert().values(rows)).rowcount
+
+
+def seen_values(table, seen_time):
+    """Return the SET clause for marking rows in a table as seen, matching the models' seen() methods."""
+    return {
+        table.c.first_seen: db.func.least(table.c.first_seen, seen_time),
+        table.c.last_seen: db.func.greatest(table.c.last_seen, seen_time)
+    }
 
 
 class HandleUniqueViolation:
@@ -177,6 +240,92 @@ class HandleUniqueViolation:
         self.session.flush()
 
 
+@compiles(CreateTable, "postgresql")
+def create_partitioned_table(element, compiler, **kwargs):
+    # Tables with partition_by in their info are created as partitioned tables
+    sql = compiler.visit_create_table(element)
+    partition_by = element.element.info.get("partition_by", None)
+    if partition_by is not None:
+        sql = sql.rstrip() + " PARTITION BY {0}\n\n".format(partition_by)
+
+    return sql
+
+
+class QueryCounter:
+    """Counts the statements executed against an engine while active, by the thread that activated it.
+
+    Other threads (such as the daemon's update) share the engine, so their statements are left out."""
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+        self.thread = None
+
+    def __enter__(self):
+        self.thread = threading.get_ident()
+        event.listen(self.engine, "before_cursor_execute", self.increment)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        event.remove(self.engine, "before_cursor_execute", self.increment)
+
+    def increment(self, *args, **kwargs):
+        if threading.get_ident() == self.thread:
+            self.count += 1
+
+
+class LookupCache:
+    """In-process cache of a lookup table mapping small integer ids to values, adding values as they are first seen.
+
+    New values are committed on their own connection straight away, so the ids handed out stay valid even if the
+    transaction that first saw them is rolled back."""
+    def __init__(self, table, id_column, value_column, labels=None):
+        self.table = table
+        self.id_column = table.c[id_column]
+        self.value_column = table.c[value_column]
+        self.labels = labels
+        self.ids = {}
+        self.values = {}
+
+    def load(self):
+        with db.engine.connect() as connection:
+            for value_id, value in connection.execute(db.select([self.id_column, self.value_column])):
+                self.ids[value] = value_id
+                self.values[value_id] = value
+
+    def id(self, value):
+        if value is None:
+            return None
+
+        if value not in self.ids:
+            try:
+                with db.engine.begin() as connection:
+                    connection.execute(self.table.insert().from_select(
+                        [self.value_column.name],
+                        db.select([db.literal(value)]).where(~db.exists().where(self.value_column == value))
+                    ))
+            except IntegrityError:
+                # Added elsewhere in the meantime
+                pass
+            self.load()
+
+        return self.ids[value]
+
+    def value(self, value_id):
+        if value_id is None:
+            return None
+
+        if value_id not in self.values:
+            self.load()
+
+        return self.values[value_id]
+
+    def label(self, value_id):
+        value = self.value(value_id)
+        if self.labels is None:
+            return value
+        return self.labels.get(value, value)
+
+
 class NativeIntEnum(db.TypeDecorator):
     """Converts between a native enum and a database integer"""
     impl = db.Integer
@@ -213,3 +362,20 @@ class NativeStringEnum(db.TypeDecorator):
         if value is None:
             return None
         return self.enum(value)
+
+
+class UUIDString(db.TypeDecorator):
+    """Converts between a UUID string and a database native UUID, returning it with or without hyphens"""
+    impl = postgres.UUID
+
+    def __init__(self, hyphens=True):
+        self.hyphens = hyphens
+        super().__init__()
+
+    def process_bind_param(self, value, dialect):
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is None or self.hyphens:
+            return value
+        return value.replace("-", "")
@@ -4,3 +4,7 @@
 
 class InterfaceException(Exception):
     pass
+
+
+class UpdateStopped(Exception):
+    pass
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+# Hawken Tracker - Stats export
+
+import os
+import json
+import shutil
+import logging
+from datetime import datetime
+
+import numpy
+from flask import current_app
+
+from hawkentracker.database import db, PlayerStats, PlayerStatsHistory, PlayerLatestStats, UpdateJournal
+from hawkentracker.mappings import ExportFlag
+from hawkentracker.util import chunks
+
+logger = logging.getLogger(__name__)
+
+export_version = 1
+manifest_name = "manifest.json"
+time_format = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+def export_columns():
+    # The stats hash is only used for skipping unchanged snapshots, so it isn't exported
+    return [column for column in PlayerStats.__table__.columns if column.key != "stats_hash"]
+
+
+def column_dtype(column):
+    if column.key == "player_id":
+        return "S36"
+    elif column.key == "snapshot_taken":
+        return "datetime64[us]"
+    elif isinstance(column.type, db.Integer):
+        return "<i8"
+    return "<f8"
+
+
+def column_masked(column):
+    # Integers have no null value, so nullable integer columns get a mask of the nulls alongside (floats use NaN)
+    return column.nullable and isinstance(column.type, db.Integer)
+
+
+def load_manifest(path):
+    filename = os.path.join(path, manifest_name)
+    if not os.path.exists(filename):
+        return None
+
+    with open(filename) as manifest_file:
+        return json.load(manifest_file)
+
+
+def save_manifest(path, manifest):
+    # Written alongside and then moved over, so an interrupted export leaves the last complete manifest
+    filename = os.path.join(path, manifest_name)
+    with open(filename + ".tmp", "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(filename + ".tmp", filename)
+
+
+def write_chunk(directory, columns, rows):
+    # Written alongside and then moved into place, replacing any chunk left by an interrupted export (which the manifest
+    # doesn't list, so it's written again)
+    staging = directory + ".tmp"
+    for leftover in (staging, directory):
+        if os.path.exists(leftover):
+            shutil.rmtree(leftover)
+    os.makedirs(staging)
+
+    for index, column in enumerate(columns):
+        values = [row[index] for row in rows]
+        if column_masked(column):
+            numpy.save(os.path.join(staging, column.key + ".mask.npy"), numpy.array([value is None for value in values], dtype=bool))
+            values = [0 if value is None else value for value in values]
+        elif column_dtype(column) == "<f8":
+            values = [numpy.nan if value is None else value for value in values]
+
+        numpy.save(os.path.join(staging, column.key + ".npy"), numpy.array(values, dtype=column_dtype(column)))
+
+    os.rename(staging, directory)
+
+
+def compacted_snapshots(columns, since, until):
+    # Snapshots moved into the compact history, as rows of the export columns
+    query = PlayerStatsHistory.query.filter(PlayerStatsHistory.first_snapshot <= until)
+    if since is not None:
+        query = query.filter(PlayerStatsHistory.last_snapshot > since)
+
+    for history in query.order_by(PlayerStatsHistory.player_id).yield_per(1000):
+        for snapshot in history.snapshots:
+            if (since is None or snapshot.snapshot_taken > since) and snapshot.snapshot_taken <= until:
+                yield tuple(history.player_id if column.key == "player_id" else getattr(snapshot, column.key, None) for column in columns)
+
+
+def stored_snapshots(columns, latest_only, since, until):
+    # Stream the snapshots in time order with a server-side cursor
+    query = db.session.query(*columns).filter(PlayerStats.snapshot_taken <= until)
+    if latest_only:
+        query = query.join(PlayerLatestStats, PlayerLatestStats.snapshot_join())
+    if since is not None:
+        query = query.filter(PlayerStats.snapshot_taken > since)
+
+    return query.order_by(PlayerStats.snapshot_taken).yield_per(current_app.config["EXPORT_CHUNK_SIZE"])
+
+
+def export_stats(flags, path=None):
+    """Export the stats history (or only the latest snapshots) into chunks of memory-mappable column arrays.
+
+    Each chunk is a directory with one .npy file per column, listed in the manifest. Snapshots are exported up to the
+    start of the last completed update, so an update in progress is left for the next export. Incremental exports append
+    chunks of the snapshots taken since then, so for the latest snapshots a player's last row wins. The history export
+    includes the compacted history, in chunks of it's own ahead of the stored snapshots.
+    Returns the number of chunks and snapshots written."""
+    if path is None:
+        path = current_app.config["EXPORT_PATH"]
+    chunk_size = current_app.config["EXPORT_CHUNK_SIZE"]
+    latest_only = ExportFlag.latest_only in flags
+    columns = export_columns()
+    time_index = [column.key for column in columns].index("snapshot_taken")
+
+    # Load or start the manifest
+    manifest = load_manifest(path)
+    if ExportFlag.incremental in flags and manifest is not None:
+        if manifest["version"] != export_version:
+            raise ValueError("Unsupported export version {0}".format(manifest["version"]))
+        if manifest["latest_only"] != latest_only:
+            raise ValueError("Existing export is of {0}".format("the latest snapshots" if manifest["latest_only"] else "the full history"))
+        if [column["name"] for column in manifest["columns"]] != [column.key for column in columns]:
+            raise ValueError("Existing export has different columns")
+    elif manifest is not None:
+        raise ValueError("An export already exists at {0}".format(path))
+    else:
+        os.makedirs(path, exist_ok=True)
+        manifest = {
+            "version": export_version,
+            "latest_only": latest_only,
+            "columns": [{"name": column.key, "dtype": column_dtype(column), "masked": column_masked(column)} for column in columns],
+            "chunks": [],
+            "exported_until": None
+        }
+
+    # Every snapshot of an update shares it's start time, and they are committed window by window, so only export up to
+    # the start of the last completed update
+    update = UpdateJournal.last_completed()
+    if update is None:
+        raise ValueError("No update has completed yet")
+    until = update.start
+    since = None if manifest["exported_until"] is None else datetime.strptime(manifest["exported_until"], time_format)
+    if since is not None and since >= until:
+        return 0, 0
+
+    sources = [stored_snapshots(columns, latest_only, since, until)]
+    if not latest_only:
+        sources.insert(0, compacted_snapshots(columns, since, until))
+
+    # The manifest is only saved once everything is written, so an interrupted export is written again in full
+    written = []
+    rows = 0
+    for source in sources:
+        for chunk in chunks(source, chunk_size):
+            name = "chunk_{0:06d}".format(len(manifest["chunks"]) + len(written))
+            logger.info("[Export] Writing %s (%d snapshots)", name, len(chunk))
+            write_chunk(os.path.join(path, name), columns, chunk)
+
+            times = [row[time_index] for row in chunk]
+            written.append({"name": name, "rows": len(chunk), "first": min(times).strftime(time_format),
+                            "last": max(times).strftime(time_format)})
+            rows += len(chunk)
+
+    manifest["chunks"].extend(written)
+    manifest["exported_until"] = until.strftime(time_format)
+    save_manifest(path, manifest)
+
+    return len(written), rows
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+# Hawken Tracker - Stats import
+
+import io
+import sys
+import gzip
+import json
+import uuid
+import logging
+from datetime import datetime
+
+from flask import current_app
+
+from hawkentracker.database import db, Player, PlayerStats, PlayerLatestStats
+from hawkentracker.database.util import create_staging_table
+from hawkentracker.retention import month_start, next_month, ensure_stats_partition
+from hawkentracker.util import chunks
+
+logger = logging.getLogger(__name__)
+
+
+def parse_time(value):
+    for time_format in ("%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S"):
+        try:
+            return datetime.strptime(value, time_format)
+        except ValueError:
+            pass
+
+    raise ValueError("Invalid snapshot time '{0}'".format(value))
+
+
+def open_dump(filename):
+    if filename == "-":
+        return sys.stdin
+    elif filename.endswith(".gz"):
+        return gzip.open(filename, "rt", encoding="utf-8")
+    return open(filename, encoding="utf-8")
+
+
+def coerce_stats(row):
+    # Check the mapped values will load, so a bad value fails with it's line rather than failing the whole COPY
+    # The stats hash is taken before this, so it matches the hash updates take of the same stats
+    int_columns, float_columns = PlayerStats.stats_columns()
+    for column in int_columns:
+        value = row[column]
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        if value is not None:
+            if not isinstance(value, int) or isinstance(value, bool):
+                raise ValueError("Invalid value for {0}: {1!r}".format(column, value))
+            if not -2 ** 31 <= value < 2 ** 31:
+                raise ValueError("Value for {0} out of range: {1}".format(column, value))
+        row[column] = value
+
+    for column in float_columns:
+        value = row[column]
+        if value is not None:
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                raise ValueError("Invalid value for {0}: {1!r}".format(column, value))
+            value = float(value)
+        row[column] = value
+
+
+def read_snapshots(lines):
+    """Read and map the snapshots of a dump into stats rows.
+
+    Each line is {"player_id": ..., "snapshot_taken": ..., "stats": {...}}, the player id falling back to the stats' Guid."""
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if line == "":
+            continue
+
+        try:
+            record = json.loads(line)
+            stats = record["stats"]
+            player_id = str(uuid.UUID(record.get("player_id") or stats["Guid"]))
+            snapshot_taken = parse_time(record["snapshot_taken"])
+
+            # Hashed as mapped, the same as updates do, before the values are converted for loading
+            row = PlayerStats.map_stats(stats)
+            row["stats_hash"] = PlayerStats.hash_stats(row)
+            coerce_stats(row)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            raise ValueError("Line {0}: {1}".format(number, e))
+
+        row["player_id"] = player_id
+        row["snapshot_taken"] = snapshot_taken
+
+        yield row
+
+
+def map_snapshots(snapshots):
+    """Order a batch of stats rows, dropping the ones that repeat the player's previous snapshot."""
+    rows = []
+    for row in sorted(snapshots, key=lambda row: (row["player_id"], row["snapshot_taken"])):
+        player_id = row["player_id"]
+        snapshot_taken = row["snapshot_taken"]
+
+        # Identical snapshots within the batch are skipped here, the ones matching stored snapshots during the merge
+        if len(rows) > 0 and rows[-1]["player_id"] == player_id and \
+                (rows[-1]["snapshot_taken"] == snapshot_taken or rows[-1]["stats_hash"] == row["stats_hash"]):
+            continue
+        rows.append(row)
+
+    return rows
+
+
+def copy_value(value):
+    if value is None:
+        return "\\N"
+    elif isinstance(value, datetime):
+        return value.isoformat()
+    elif isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def copy_rows(table, columns, rows):
+    # Load the rows through COPY in the text format (nothing imported can contain tabs, newlines or backslashes)
+    data = io.StringIO()
+    for row in rows:
+        data.write("\t".join(copy_value(row[column]) for column in columns))
+        data.write("\n")
+    data.seek(0)
+
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert("COPY {0} ({1}) FROM STDIN".format(table.name, ", ".join(columns)), data)
+    finally:
+        cursor.close()
+
+
+def merge_snapshots(staging):
+    # Widen the times players were seen over to the snapshots imported for them
+    players = Player.__table__
+    seen = db.select([staging.c.player_id, db.func.min(staging.c.snapshot_taken).label("first_seen"),
+                      db.func.max(staging.c.snapshot_taken).label("last_seen")]).\
+              group_by(staging.c.player_id).\
+              alias("seen")
+    db.session.execute(
+        players.update().
+                where(players.c.player_id == seen.c.player_id).
+                values({
+                    players.c.first_seen: db.func.least(players.c.first_seen, seen.c.first_seen),
+                    players.c.last_seen: db.func.greatest(players.c.last_seen, seen.c.last_seen)
+                })
+    )
+
+    # Add any players not seen before, seen over the time their snapshots cover
+    new_players = db.session.execute(
+        players.insert().from_select(
+            ["player_id", "first_seen", "last_seen", "blacklisted"],
+            db.select([staging.c.player_id, db.func.min(staging.c.snapshot_taken), db.func.max(staging.c.snapshot_taken), db.false()]).
+              where(~db.exists().where(players.c.player_id == staging.c.player_id)).
+              group_by(staging.c.player_id)
+        )
+    ).rowcount
+
+    # Add the snapshots not already stored, skipping any identical to the player's snapshot before it like updates do
+    stats = PlayerStats.__table__
+    columns = [column.key for column in stats.columns]
+    previous = db.select([stats.c.stats_hash]).\
+                  where(stats.c.player_id == staging.c.player_id).\
+                  where(stats.c.snapshot_taken < staging.c.snapshot_taken).\
+                  order_by(stats.c.snapshot_taken.desc()).\
+                  limit(1).\
+                  as_scalar()
+    imported = db.session.execute(
+        stats.insert().from_select(
+            columns,
+            db.select([staging.c[column] for column in columns]).
+              where(~db.exists().where(db.and_(stats.c.player_id == staging.c.player_id, stats.c.snapshot_taken == staging.c.snapshot_taken))).
+              where(db.or_(previous.is_(None), staging.c.stats_hash != previous))
+        )
+    ).rowcount
+
+    # Point the players at their newest snapshot, if it's newer than their current one
+    latest = PlayerLatestStats.__table__
+    newest = db.select([staging.c.player_id, db.func.max(staging.c.snapshot_taken).label("snapshot_taken")]).\
+                where(db.exists().where(db.and_(stats.c.player_id == staging.c.player_id, stats.c.snapshot_taken == staging.c.snapshot_taken))).\
+                group_by(staging.c.player_id).\
+                alias("newest")
+    db.session.execute(
+        latest.update().
+               where(latest.c.player_id == newest.c.player_id).
+               where(latest.c.snapshot_taken < newest.c.snapshot_taken).
+               values({latest.c.snapshot_taken: newest.c.snapshot_taken})
+    )
+    db.session.execute(
+        latest.insert().from_select(
+            ["player_id", "snapshot_taken"],
+            db.select([newest.c.player_id, newest.c.snapshot_taken]).
+              where(~db.exists().where(latest.c.player_id == newest.c.player_id))
+        )
+    )
+
+    return imported, new_players
+
+
+def import_stats(filename):
+    """Import newline-delimited JSON stats snapshots from a dump, in batches.
+
+    Each batch is mapped the same way as updates do, copied into a staging table and merged in a single transaction.
+    Returns the number of snapshots read and imported, and the number of new players."""
+    batch_size = current_app.config["IMPORT_BATCH_SIZE"]
+    columns = [column.key for column in PlayerStats.__table__.columns]
+
+    read = 0
+    imported = 0
+    new_players = 0
+    with open_dump(filename) as lines:
+        for batch in chunks(read_snapshots(lines), batch_size):
+            rows = map_snapshots(batch)
+
+            # Make sure the snapshots have partitions to go to
+            month = month_start(min(row["snapshot_taken"] for row in rows))
+            end = max(row["snapshot_taken"] for row in rows)
+            while month <= end:
+                ensure_stats_partition(month)
+                month = next_month(month)
+
+            staging = create_staging_table(db.session, "import_stats",
+                                           *[db.Column(column.key, column.type) for column in PlayerStats.__table__.columns])
+            copy_rows(staging, columns, rows)
+            batch_imported, batch_players = merge_snapshots(staging)
+            db.session.commit()
+
+            read += len(batch)
+            imported += batch_imported
+            new_players += batch_players
+            logger.info("[Import] Imported %d of %d snapshots (%d read so far)", batch_imported, len(batch), read)
+
+    return read, imported, new_players
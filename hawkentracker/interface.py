@@ -71,14 +71,18 @@ def api_wrapper(func):
     raise InterfaceException from last_exception
 
 
-@current_app.teardown_appcontext
-def teardown_api(exception):
+def save_api_token():
     client = g.get("api_client", None)
     if client is not None and client.authed:
         redis = get_redis()
         redis.set(format_redis_key("api_token"), client.grant.token)
 
 
+def teardown_api(exception):
+    # Registered by create_app, so this module can be imported without an app (as ranking worker processes do)
+    save_api_token()
+
+
 def get_player_id(player, callsign=True):
     api = get_api()
 
@@ -10,6 +10,7 @@ from hawkentracker.util import CaseInsensitiveDict
 @unique
 class PollFlag(Enum):
     empty_matches = "empty_matches"
+    full_poll = "full"
 
 
 @unique
@@ -54,6 +55,19 @@ class UpdateStage(IntEnum):
     global_rankings = 4
 
 
+@unique
+class StatsResolution(Enum):
+    full = "full"
+    daily = "daily"
+    weekly = "weekly"
+
+
+@unique
+class ExportFlag(Enum):
+    latest_only = "latest"
+    incremental = "incremental"
+
+
 # Redis ranked fields
 ranking_fields = ("mmr", "time_played", "xp", "xp_per_min", "hc", "hc_per_min", "kda", "kill_steal_ratio",
                   "critical_assist_ratio", "damage_ratio", "win_loss", "dm_win_loss", "tdm_win_loss", "ma_win_loss",
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+# Hawken Tracker - Ranking storage
+
+import itertools
+
+from flask import current_app
+from redis.exceptions import ResponseError
+
+from hawkentracker.interface import get_redis, format_redis_key
+from hawkentracker.util import chunks
+
+# Competition-style rank (1 + the number of strictly higher scores) for each player given, or nil if unranked
+rank_script = """
+local ranks = {}
+for i, player in ipairs(ARGV) do
+    local score = redis.call("ZSCORE", KEYS[1], player)
+    if score then
+        ranks[i] = redis.call("ZCOUNT", KEYS[1], "(" .. score, "+inf") + 1
+    else
+        ranks[i] = false
+    end
+end
+return ranks
+"""
+
+
+def decode_rank(rank):
+    if rank is None:
+        return None
+    return int(rank)
+
+
+def unlink(redis, key):
+    # Free the key in the background where supported (redis 4.0+), as large rankings block redis while deleted
+    try:
+        redis.execute_command("UNLINK", key)
+    except ResponseError:
+        redis.delete(key)
+
+
+class Rankings:
+    """Base for the ranking storage backends.
+
+    Rankings are built into staging keys and then swapped in with an atomic rename, so readers never see a partial
+    ranking. Writes are batched into pipelines.
+
+    Backends that keep the players ordered by score (the order key) can also be updated incrementally, applying only
+    the changed scores and re-deriving positions for the range of scores they affect."""
+    pipeline_batches = 10
+    page_size = 5000
+
+    def __init__(self, redis, field, names):
+        self.redis = redis
+        self.field = field
+        self.keys = [format_redis_key(name, field) for name in names]
+        self.staging_keys = [format_redis_key(name, field, "staging") for name in names]
+        self.old_keys = [format_redis_key(name, field, "old") for name in names]
+        self.key = self.keys[0]
+        self.staging_key = self.staging_keys[0]
+        self.order_key = None
+        self.pipeline = None
+        self.queued = 0
+
+    def start(self):
+        # Clear anything left over from an interrupted build
+        for key in self.staging_keys + self.old_keys:
+            unlink(self.redis, key)
+
+        self.pipeline = self.redis.pipeline(transaction=False)
+        self.queued = 0
+
+    def store(self, rows):
+        # Rows are (player, score, position)
+        self.write(self.pipeline, rows)
+        self.queued += 1
+
+        if self.queued >= self.pipeline_batches:
+            self.pipeline.execute()
+            self.queued = 0
+
+    def finish(self, total):
+        self.write_total(self.pipeline, total)
+        self.pipeline.execute()
+        self.pipeline = None
+
+        self.publish()
+
+    def publish(self):
+        # Swap the new rankings in atomically, moving the current ones out of the way so they can be freed afterwards
+        # If nothing was ranked there is no staging key, which leaves the field without rankings
+        swap = self.redis.pipeline(transaction=True)
+        retired = []
+        for key, staging_key, old_key in zip(self.keys, self.staging_keys, self.old_keys):
+            if self.redis.exists(key):
+                swap.rename(key, old_key)
+                retired.append(old_key)
+            if self.redis.exists(staging_key):
+                swap.rename(staging_key, key)
+        swap.execute()
+
+        for key in retired:
+            unlink(self.redis, key)
+
+    def can_update(self):
+        return self.order_key is not None and self.redis.exists(self.order_key)
+
+    def update(self, changes):
+        """Apply changed scores to the current rankings.
+
+        Changes are (player, score), with a score of None for players that should no longer be ranked. Returns the
+        number of players whose score changed."""
+        # Look up the previous scores
+        pipeline = self.redis.pipeline(transaction=False)
+        for player, _ in changes:
+            pipeline.zscore(self.order_key, player)
+        previous = pipeline.execute()
+
+        # Work out the range of scores affected - moving a player shifts the positions between its old and new score,
+        # while adding or removing one shifts every position below it
+        ranked = []
+        removed = []
+        affected = []
+        to_bottom = False
+        for (player, score), old in zip(changes, previous):
+            if score is None:
+                if old is not None:
+                    removed.append(player)
+                    affected.append(old)
+                    to_bottom = True
+            elif old is None or old != score:
+                ranked.append((player, score))
+                affected.append(score)
+                if old is None:
+                    to_bottom = True
+                else:
+                    affected.append(old)
+
+        if len(affected) == 0:
+            return 0
+
+        # Apply the new scores
+        pipeline = self.redis.pipeline(transaction=True)
+        for batch in chunks(removed, self.page_size):
+            pipeline.zrem(self.order_key, *batch)
+            self.remove(pipeline, batch)
+        for batch in chunks(ranked, self.page_size):
+            pipeline.zadd(self.order_key, *itertools.chain.from_iterable((score, player) for player, score in batch))
+        pipeline.execute()
+
+        # Re-derive the positions within the affected range
+        self.reposition(max(affected), "-inf" if to_bottom else min(affected))
+
+        return len(ranked) + len(removed)
+
+    def remove(self, pipeline, players):
+        pass
+
+    def reposition(self, high, low):
+        pass
+
+    def write(self, pipeline, rows):
+        raise NotImplementedError
+
+    def write_total(self, pipeline, total):
+        pass
+
+    def neighborhood(self, player, size):
+        raise NotImplementedError
+
+
+class HashRankings(Rankings):
+    """Stores a field's rankings as a redis hash of player to position, with the number of ranked players under "total".
+
+    The scores are also kept in a sorted set, so the positions can be re-derived when updated incrementally and rank
+    neighborhoods can be looked up."""
+    def __init__(self, redis, field):
+        super().__init__(redis, field, ["rank", "rank_order"])
+        self.order_key = self.keys[1]
+
+    def write(self, pipeline, rows):
+        pipeline.hmset(self.staging_key, {player: position for player, _, position in rows})
+        pipeline.zadd(self.staging_keys[1], *itertools.chain.from_iterable((score, player) for player, score, _ in rows))
+
+    def write_total(self, pipeline, total):
+        pipeline.hset(self.staging_key, "total", total)
+
+    def remove(self, pipeline, players):
+        pipeline.hdel(self.key, *players)
+
+    def reposition(self, high, low):
+        # Positions are by index in the order, so walk it from the first player in the range to the last
+        start = self.redis.zcount(self.order_key, "({0!r}".format(high), "+inf")
+        end = self.redis.zcount(self.order_key, low, "+inf") - 1
+
+        pipeline = self.redis.pipeline(transaction=False)
+        position = None
+        last = None
+        for offset in range(start, end + 1, self.page_size):
+            players = self.redis.zrevrange(self.order_key, offset, min(offset + self.page_size, end + 1) - 1, withscores=True)
+            positions = {}
+            for index, (player, score) in enumerate(players, offset):
+                if score != last:
+                    position = index + 1
+                last = score
+                positions[player] = position
+
+            if len(positions) > 0:
+                pipeline.hmset(self.key, positions)
+        pipeline.hset(self.key, "total", self.redis.zcard(self.order_key))
+        pipeline.execute()
+
+    def total(self):
+        return decode_rank(self.redis.hget(self.key, "total"))
+
+    def rank(self, player):
+        return decode_rank(self.redis.hget(self.key, player))
+
+    def ranks(self, players):
+        return {player: decode_rank(rank) for player, rank in zip(players, self.redis.hmget(self.key, players))}
+
+    def neighborhood(self, player, size):
+        # Walk the order, with the positions looked up from the hash
+        index = self.redis.zrevrank(self.order_key, player)
+        if index is None:
+            return None
+
+        players = self.redis.zrevrange(self.order_key, max(index - size, 0), index + size, withscores=True)
+        if len(players) == 0:
+            return []
+
+        positions = self.redis.hmget(self.key, [player for player, _ in players])
+        return [(player.decode(), decode_rank(position), score) for (player, score), position in zip(players, positions)]
+
+
+class SortedSetRankings(Rankings):
+    """Stores a field's rankings as a redis sorted set of player by score.
+
+    Positions are derived when read, giving tied scores the same position as the hash rankings do."""
+    def __init__(self, redis, field):
+        super().__init__(redis, field, ["rank_scores"])
+        self.order_key = self.key
+        self.rank_script = redis.register_script(rank_script)
+
+    def write(self, pipeline, rows):
+        pipeline.zadd(self.staging_key, *itertools.chain.from_iterable((score, player) for player, score, _ in rows))
+
+    def total(self):
+        return self.redis.zcard(self.key)
+
+    def rank(self, player):
+        return decode_rank(self.rank_script(keys=[self.key], args=[player])[0])
+
+    def ranks(self, players):
+        return {player: decode_rank(rank) for player, rank in zip(players, self.rank_script(keys=[self.key], args=players))}
+
+    def top(self, count):
+        return self.ranked_range(0, count - 1)
+
+    def neighborhood(self, player, size):
+        index = self.redis.zrevrank(self.key, player)
+        if index is None:
+            return None
+
+        return self.ranked_range(max(index - size, 0), index + size)
+
+    def ranked_range(self, start, end):
+        # Load the players in the range, ordered by score
+        players = self.redis.zrevrange(self.key, start, end, withscores=True)
+        if len(players) == 0:
+            return []
+
+        # Only the first player needs a lookup, as every score change after it is a position in the whole set
+        position = self.redis.zcount(self.key, "({0!r}".format(players[0][1]), "+inf") + 1
+        ranked = []
+        last = None
+        for index, (player, score) in enumerate(players, start):
+            if last is not None and score != last:
+                position = index + 1
+            last = score
+            ranked.append((player.decode(), position, score))
+
+        return ranked
+
+
+ranking_backends = {
+    "hash": HashRankings,
+    "sorted_set": SortedSetRankings
+}
+
+
+def get_rankings(field):
+    backend = ranking_backends[current_app.config["RANKING_BACKEND"]]
+    return backend(get_redis(), field)
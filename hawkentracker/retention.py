@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+# Hawken Tracker - Stats partitions and retention
+
+import re
+import logging
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from hawkentracker.database import db, PlayerStats, PlayerStatsPartition, PlayerStatsHistory, PlayerLatestStats
+from hawkentracker.mappings import StatsResolution
+from hawkentracker.util import chunks
+
+logger = logging.getLogger(__name__)
+
+# Period each resolution keeps one snapshot per player for
+resolution_periods = {
+    StatsResolution.daily: "day",
+    StatsResolution.weekly: "week"
+}
+
+
+def month_start(time):
+    return datetime(time.year, time.month, 1)
+
+
+def next_month(time):
+    if time.month == 12:
+        return datetime(time.year + 1, 1, 1)
+    return datetime(time.year, time.month + 1, 1)
+
+
+def partition_bounds(partition):
+    start = "MINVALUE" if partition.range_start is None else "'{0}'".format(partition.range_start.isoformat())
+    return "FROM ({0}) TO ('{1}')".format(start, partition.range_end.isoformat())
+
+
+def create_partition_table(name):
+    db.session.execute("CREATE TABLE {0} (LIKE {1} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)".format(name, PlayerStats.__tablename__))
+
+
+def ensure_stats_partition(time):
+    """Make sure there is a partition for the month the time falls in, creating it if needed."""
+    if PlayerStatsPartition.covering(time) is not None:
+        return None
+
+    partition = PlayerStatsPartition(name="player_stats_{0:%Y_%m}".format(time), range_start=month_start(time),
+                                     range_end=next_month(time), resolution=StatsResolution.full)
+    logger.info("[Stats] Creating partition %s", partition.name)
+
+    # Create the partition on it's own, moving in any snapshots that ended up in the default partition, then attach it
+    create_partition_table(partition.name)
+    db.session.execute("WITH moved AS (DELETE FROM player_stats_default WHERE snapshot_taken >= :start AND snapshot_taken < :end RETURNING *) "
+                       "INSERT INTO {0} SELECT * FROM moved".format(partition.name),
+                       {"start": partition.range_start, "end": partition.range_end})
+    db.session.execute("ALTER TABLE {0} ATTACH PARTITION {1} FOR VALUES {2}".format(PlayerStats.__tablename__, partition.name,
+                                                                                  partition_bounds(partition)))
+    db.session.add(partition)
+
+    return partition
+
+
+def downsample_partition(partition, resolution):
+    """Replace a partition with one keeping a single snapshot per player per period of the resolution.
+
+    The last snapshot of each period is kept, so the latest snapshot of every player is always kept."""
+    name = "{0}_{1}".format(re.sub(r"_(daily|weekly)$", "", partition.name), resolution.value)
+    period = resolution_periods[resolution]
+    logger.info("[Stats] Downsampling partition %s to %s", partition.name, name)
+
+    create_partition_table(name)
+    kept = db.session.execute("INSERT INTO {0} SELECT DISTINCT ON (player_id, date_trunc('{1}', snapshot_taken)) * FROM {2} "
+                              "ORDER BY player_id, date_trunc('{1}', snapshot_taken), snapshot_taken DESC".format(name, period, partition.name)).rowcount
+
+    # Swap the downsampled partition in
+    db.session.execute("ALTER TABLE {0} DETACH PARTITION {1}".format(PlayerStats.__tablename__, partition.name))
+    db.session.execute("ALTER TABLE {0} ATTACH PARTITION {1} FOR VALUES {2}".format(PlayerStats.__tablename__, name, partition_bounds(partition)))
+    if current_app.config["STATS_KEEP_DETACHED"]:
+        logger.info("[Stats] Keeping detached partition %s", partition.name)
+    else:
+        db.session.execute("DROP TABLE {0}".format(partition.name))
+
+    # The primary key can't be changed in place
+    db.session.add(PlayerStatsPartition(name=name, range_start=partition.range_start, range_end=partition.range_end, resolution=resolution))
+    db.session.delete(partition)
+
+    return kept
+
+
+def split_partition(partition):
+    """Split a partition covering more than a month into monthly partitions of the same resolution.
+
+    Used for the archive partition the partitioning migration made of the existing snapshots, so each month of it goes
+    through the retention tiers on it's own. Returns the number of partitions created."""
+    logger.info("[Stats] Splitting partition %s into monthly partitions", partition.name)
+    first, = db.session.execute("SELECT min(snapshot_taken) FROM {0}".format(partition.name)).fetchone()
+    if partition.range_start is not None:
+        start = partition.range_start
+    elif first is not None:
+        start = month_start(first)
+    else:
+        # Nothing to move, anything older goes to the default partition
+        start = month_start(partition.range_end - timedelta(days=1))
+
+    db.session.execute("ALTER TABLE {0} DETACH PARTITION {1}".format(PlayerStats.__tablename__, partition.name))
+
+    created = 0
+    month = start
+    while month < partition.range_end:
+        split = PlayerStatsPartition(name="player_stats_{0:%Y_%m}".format(month), range_start=month, range_end=next_month(month),
+                                     resolution=partition.resolution)
+        create_partition_table(split.name)
+        db.session.execute("INSERT INTO {0} SELECT * FROM {1} WHERE snapshot_taken >= :start AND snapshot_taken < :end".format(split.name, partition.name),
+                           {"start": split.range_start, "end": split.range_end})
+        db.session.execute("ALTER TABLE {0} ATTACH PARTITION {1} FOR VALUES {2}".format(PlayerStats.__tablename__, split.name, partition_bounds(split)))
+        db.session.add(split)
+        created += 1
+        month = split.range_end
+
+    if current_app.config["STATS_KEEP_DETACHED"]:
+        logger.info("[Stats] Keeping detached partition %s", partition.name)
+    else:
+        db.session.execute("DROP TABLE {0}".format(partition.name))
+    db.session.delete(partition)
+
+    return created
+
+
+def maintain_stats_partitions(now=None):
+    """Create the partitions for this month and the next, split any partition covering more than a month, and downsample
+    the partitions past the retention ages.
+
+    Returns a list of (partition, resolution, snapshots kept) for the partitions downsampled."""
+    if now is None:
+        now = datetime.utcnow()
+
+    # Partitions are created ahead of time, so snapshots don't land in the default partition
+    for time in (now, next_month(now)):
+        ensure_stats_partition(time)
+    db.session.commit()
+
+    daily_before = now - timedelta(days=current_app.config["STATS_DAILY_AFTER"])
+    weekly_before = now - timedelta(days=current_app.config["STATS_WEEKLY_AFTER"])
+
+    # Partitions covering more than a month are split first, so the tiers apply to each month
+    for partition in PlayerStatsPartition.query.order_by(PlayerStatsPartition.range_end).all():
+        if partition.range_start is None or next_month(partition.range_start) < partition.range_end:
+            split_partition(partition)
+            db.session.commit()
+
+    downsampled = []
+    for partition in PlayerStatsPartition.query.order_by(PlayerStatsPartition.range_end).all():
+        # Only partitions that are past the age entirely are downsampled
+        if partition.range_end <= weekly_before and partition.resolution != StatsResolution.weekly:
+            resolution = StatsResolution.weekly
+        elif partition.range_end <= daily_before and partition.resolution == StatsResolution.full:
+            resolution = StatsResolution.daily
+        else:
+            continue
+
+        name = partition.name
+        kept = downsample_partition(partition, resolution)
+        db.session.commit()
+
+        downsampled.append((name, resolution, kept))
+
+    return downsampled
+
+
+def compact_stats_history(before=None):
+    """Move the snapshots taken before the time into the players' compact histories.
+
+    The latest snapshot of each player is always left in the stats table. Returns the number of players compacted and
+    the number of snapshots moved."""
+    if before is None:
+        before = datetime.utcnow() - timedelta(days=current_app.config["STATS_COMPACT_AFTER"])
+
+    def compactable():
+        return db.and_(PlayerStats.snapshot_taken < before,
+                       ~db.exists().where(PlayerLatestStats.snapshot_join()))
+
+    player_ids = [player_id for player_id, in db.session.query(PlayerStats.player_id).filter(compactable()).distinct()]
+    logger.info("[Stats] Compacting the history of %d players", len(player_ids))
+
+    players = 0
+    moved = 0
+    for chunk in chunks(player_ids, current_app.config["TRACKER_BATCH_SIZE"]):
+        snapshots = {}
+        for stats in PlayerStats.query.filter(PlayerStats.player_id.in_(chunk)).filter(compactable()).order_by(PlayerStats.snapshot_taken):
+            snapshots.setdefault(stats.player_id, []).append(stats)
+        histories = {history.player_id: history for history in PlayerStatsHistory.query.filter(PlayerStatsHistory.player_id.in_(chunk))}
+
+        for player_id, new in snapshots.items():
+            history = histories.get(player_id)
+            if history is None:
+                history = PlayerStatsHistory(player_id=player_id)
+                combined = new
+            else:
+                # Snapshots may have been imported out of order, so merge by time with the stored ones winning ties
+                merged = {snapshot.snapshot_taken: snapshot for snapshot in new}
+                merged.update((snapshot.snapshot_taken, snapshot) for snapshot in history.snapshots)
+                combined = [merged[taken] for taken in sorted(merged.keys())]
+
+            history.store(combined)
+            db.session.add(history)
+            moved += len(new)
+
+        db.session.execute(PlayerStats.__table__.delete().where(PlayerStats.player_id.in_(chunk)).where(compactable()))
+        db.session.commit()
+        db.session.expunge_all()
+        players += len(snapshots)
+
+    return players, moved
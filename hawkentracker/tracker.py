@@ -1,19 +1,37 @@
 # -*- coding: utf-8 -*-
 # Hawken Tracker - Player/Match Tracker
 
+import os
+import json
+import hashlib
 import logging
+import resource
+import tempfile
 import itertools
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from functools import wraps
 
+import msgpack
+import numpy
 from sqlalchemy.orm import contains_eager
+from sqlalchemy.orm.attributes import set_committed_value
 from flask import current_app
 
+from hawkentracker import create_app
+from hawkentracker.exceptions import UpdateStopped
 from hawkentracker.interface import get_api, api_wrapper, get_redis, format_redis_key
-from hawkentracker.database import db, Player, PlayerStats, Match, MatchPlayer, PollJournal, UpdateJournal
-from hawkentracker.database.util import HandleUniqueViolation, windowed_query
+from hawkentracker.rankings import get_rankings
+from hawkentracker.retention import ensure_stats_partition
+from hawkentracker.database import db, Player, PlayerStats, PlayerLatestStats, PlayerRegionCount, ServerRegion, Match, MatchPlayer,\
+    PollJournal, UpdateJournal
+from hawkentracker.database.util import HandleUniqueViolation, windowed_query, create_staging_table, bulk_insert,\
+    seen_values, QueryCounter, UUIDString
+from hawkentracker.util import chunks
 from hawkentracker.mappings import PollFlag, PollStatus, PollStage, UpdateFlag, UpdateStatus, UpdateStage,\
-    ranking_fields, region_groupings
+    ranking_fields
 
 logger = logging.getLogger(__name__)
 
@@ -43,7 +61,7 @@ class CallsignConflictResolver:
         Player.query.filter(Player.player_id.in_(list(conflicted_users.keys()))).update({Player.callsign: None}, synchronize_session=False)
 
         # Update callsigns for conflicting users
-        for guid, new_callsign in conflicted_users:
+        for guid, new_callsign in conflicted_users.items():
             Player.query.filter(Player.player_id == guid).update({Player.callsign: new_callsign}, synchronize_session=False)
 
     def resolve_callsigns(self):
@@ -92,91 +110,405 @@ def load_server_list(journal):
         # players and not matches, we can save some time and space ignoring all the empty matches.
         matches = {match_id: server for match_id, server in matches.items() if len(server["Users"]) > 0}
 
-    return players, matches
+    # Load the previous server list snapshot
+    previous = load_poll_snapshot(journal)
 
+    return players, matches, previous
 
-def update_seen_players(players, journal):
+
+def server_info_hash(info):
+    return hashlib.md5(json.dumps(info, sort_keys=True).encode("utf-8")).digest()
+
+
+def load_poll_snapshot(journal):
+    if PollFlag.full_poll in journal.flags:
+        return None
+
+    data = get_redis().get(format_redis_key("poll", "snapshot"))
+    if data is None:
+        logger.debug("[Servers] No previous server list snapshot, performing full poll")
+        return None
+
+    # Only use the snapshot if it matches what the last completed poll wrote to the database
+    snapshot = msgpack.unpackb(data, encoding="utf-8")
+    last_journal = PollJournal.last_completed()
+    if last_journal is None or snapshot["start"] != last_journal.start.isoformat():
+        logger.debug("[Servers] Previous server list snapshot is stale, performing full poll")
+        return None
+
+    return snapshot
+
+
+def save_poll_snapshot(players, matches, journal):
+    snapshot = {
+        "start": journal.start.isoformat(),
+        "players": players,
+        "matches": {match_id: [server_info_hash(Match.parse_server_info(server)), list(set(server["Users"]))]
+                    for match_id, server in matches.items()}
+    }
+
+    get_redis().set(format_redis_key("poll", "snapshot"), msgpack.packb(snapshot, use_bin_type=True))
+
+
+def update_seen_players(players, journal, previous=None):
     logger.info("[Players] Updating seen players")
+    journal.players_updated = 0
+    journal.players_added = 0
+
+    if previous is not None:
+        # Players seen in the previous poll are known to exist, so they only need to be marked as seen
+        previous_players = set(previous["players"])
+        known_players = [guid for guid in players if guid in previous_players]
+        players = [guid for guid in players if guid not in previous_players]
+
+        if len(known_players) > 0:
+            logger.debug("[Players] Marking previously seen players")
+            journal.players_updated += Player.query.filter(Player.player_id.in_(known_players)).\
+                                                    update({Player.last_seen: journal.start}, synchronize_session=False)
+
+    if len(players) == 0:
+        return
 
     # Collect existing players
     existing_players = [guid for guid, in db.session.query(Player.player_id).filter(Player.player_id.in_(players))]
 
-    # Update existing players
-    logger.debug("[Players] Updating existing players")
-    Player.query.filter(Player.player_id.in_(existing_players)).update({Player.last_seen: journal.start}, synchronize_session=False)
-
     # Collect new players
     new_players = list(set(players).difference(existing_players))
 
+    # Load callsigns
+    callsigns = {}
     if len(new_players) > 0:
-        # Load callsigns
         logger.debug("[Players] Loading player callsigns")
         callsigns = api_wrapper(lambda: get_api().get_user_callsign(new_players, cache_skip=True))
 
-        @CallsignConflictResolver(logger, callsigns)
-        def add_players(players, callsigns):
-            # Add new players
-            logger.debug("[Players] Adding new players")
-            for guid in players:
-                player = Player(player_id=guid)
-                player.callsign = callsigns.get(guid, None)
-                player.seen(journal.start)
-                db.session.add(player)
+    # Stage the seen players
+    logger.debug("[Players] Staging seen players")
+    staging = create_staging_table(db.session, "poll_players",
+                                   db.Column("player_id", UUIDString(), primary_key=True),
+                                   db.Column("callsign", db.String))
+    bulk_insert(db.session, staging, [{"player_id": guid, "callsign": callsigns.get(guid, None)} for guid in players])
 
-        add_players(new_players, callsigns)
+    @CallsignConflictResolver(logger, callsigns)
+    def merge_players():
+        players_table = Player.__table__
+
+        # Update existing players
+        logger.debug("[Players] Updating existing players")
+        updated = db.session.execute(
+            players_table.update().
+                          where(players_table.c.player_id == staging.c.player_id).
+                          values(seen_values(players_table, journal.start))
+        ).rowcount
+
+        # Add new players
+        logger.debug("[Players] Adding new players")
+        added = db.session.execute(
+            players_table.insert().from_select(
+                ["player_id", "callsign", "first_seen", "last_seen", "blacklisted"],
+                db.select([staging.c.player_id, staging.c.callsign, db.literal(journal.start), db.literal(journal.start), db.false()]).
+                   where(~db.exists().where(players_table.c.player_id == staging.c.player_id))
+            )
+        ).rowcount
+
+        return updated, added
+
+    updated, added = merge_players()
+    journal.players_updated += updated
+    journal.players_added += added
+
+
+def update_seen_matches(matches, journal, previous=None):
+    logger.info("[Matches] Updating seen matches")
+    matches_table = Match.__table__
+    match_players_table = MatchPlayer.__table__
+    journal.matches_updated = 0
+    journal.matches_added = 0
+
+    server_info = {match_id: Match.parse_server_info(server) for match_id, server in matches.items()}
+    match_players = {match_id: set(server["Users"]) for match_id, server in matches.items()}
+
+    if previous is not None:
+        # Split out the matches and match players that have not changed since the previous poll
+        unchanged_matches = []
+        unchanged_players = []
+        for match_id, (info_hash, users) in previous["matches"].items():
+            if match_id not in server_info:
+                continue
+
+            stayed = match_players[match_id].intersection(users)
+            unchanged_players.extend((match_id, player) for player in stayed)
+            match_players[match_id].difference_update(stayed)
+
+            if info_hash == server_info_hash(server_info[match_id]):
+                unchanged_matches.append(match_id)
+                del server_info[match_id]
+
+        # Mark the unchanged matches and match players as seen
+        if len(unchanged_matches) > 0:
+            logger.debug("[Matches] Marking unchanged matches")
+            journal.matches_updated += Match.query.filter(Match.match_id.in_(unchanged_matches)).\
+                                                   update({Match.last_seen: journal.start}, synchronize_session=False)
+        if len(unchanged_players) > 0:
+            logger.debug("[Matches] Marking unchanged match players")
+            MatchPlayer.query.filter(db.tuple_(MatchPlayer.match_id, MatchPlayer.player_id).in_(unchanged_players)).\
+                              update({MatchPlayer.last_seen: journal.start}, synchronize_session=False)
+
+    if len(server_info) > 0:
+        # Stage the new or changed matches
+        logger.debug("[Matches] Staging seen matches")
+        staged_matches = create_staging_table(db.session, "poll_matches",
+                                              db.Column("match_id", UUIDString(hyphens=False), primary_key=True),
+                                              db.Column("server_name_id", db.SmallInteger),
+                                              db.Column("server_region_id", db.SmallInteger),
+                                              db.Column("server_gametype_id", db.SmallInteger),
+                                              db.Column("server_map_id", db.SmallInteger),
+                                              db.Column("server_version_id", db.SmallInteger),
+                                              db.Column("server_matchmaking", db.Boolean),
+                                              db.Column("server_tournament", db.Boolean),
+                                              db.Column("server_password_protected", db.Boolean),
+                                              db.Column("server_mmr_ignored", db.Boolean))
+        bulk_insert(db.session, staged_matches, [dict(info, match_id=match_id) for match_id, info in server_info.items()])
+
+        server_columns = [column for column in staged_matches.c.keys() if column != "match_id"]
+
+        # Move the region counts of the players of matches changing region, while the matches still have the old one
+        logger.debug("[Matches] Moving player region counts")
+        move_region_counts(staged_matches)
+
+        # Update existing matches
+        logger.debug("[Matches] Updating existing matches")
+        values = seen_values(matches_table, journal.start)
+        values.update({matches_table.c[column]: staged_matches.c[column] for column in server_columns})
+        journal.matches_updated += db.session.execute(
+            matches_table.update().
+                          where(matches_table.c.match_id == staged_matches.c.match_id).
+                          values(values)
+        ).rowcount
+
+        # Add new matches
+        logger.debug("[Matches] Adding new matches")
+        journal.matches_added += db.session.execute(
+            matches_table.insert().from_select(
+                ["match_id", "first_seen", "last_seen"] + server_columns,
+                db.select([staged_matches.c.match_id, db.literal(journal.start), db.literal(journal.start)] +
+                          [staged_matches.c[column] for column in server_columns]).
+                   where(~db.exists().where(matches_table.c.match_id == staged_matches.c.match_id))
+            )
+        ).rowcount
+
+    staged_rows = [{"match_id": match_id, "player_id": player} for match_id, players in match_players.items() for player in players]
+    if len(staged_rows) > 0:
+        # Stage the new match players
+        logger.debug("[Matches] Staging seen match players")
+        staged_players = create_staging_table(db.session, "poll_match_players",
+                                              db.Column("match_id", UUIDString(hyphens=False), primary_key=True),
+                                              db.Column("player_id", UUIDString(), primary_key=True))
+        bulk_insert(db.session, staged_players, staged_rows)
+
+        # Update existing match players
+        logger.debug("[Matches] Updating existing match players")
+        db.session.execute(
+            match_players_table.update().
+                                where(match_players_table.c.match_id == staged_players.c.match_id).
+                                where(match_players_table.c.player_id == staged_players.c.player_id).
+                                values(seen_values(match_players_table, journal.start))
+        )
+
+        new_links = ~db.exists().where(db.and_(match_players_table.c.match_id == staged_players.c.match_id,
+                                               match_players_table.c.player_id == staged_players.c.player_id))
+
+        # Count the regions of the newly linked players (before they are linked)
+        logger.debug("[Matches] Updating player region counts")
+        update_region_counts(staged_players, new_links)
+
+        # Add new match players
+        logger.debug("[Matches] Adding new match players")
+        db.session.execute(
+            match_players_table.insert().from_select(
+                ["match_id", "player_id", "first_seen", "last_seen"],
+                db.select([staged_players.c.match_id, staged_players.c.player_id, db.literal(journal.start), db.literal(journal.start)]).
+                   where(new_links)
+            )
+        )
+
+
+def update_region_counts(staged_players, new_links):
+    matches_table = Match.__table__
+    regions_table = ServerRegion.__table__
+    region = PlayerRegionCount.group_region(regions_table.c.region)
+
+    # Stage the region counts of the new links
+    staged_counts = create_staging_table(db.session, "poll_region_counts",
+                                         db.Column("player_id", UUIDString(), primary_key=True),
+                                         db.Column("region", db.String, primary_key=True),
+                                         db.Column("matches", db.Integer))
+    db.session.execute(
+        staged_counts.insert().from_select(
+            ["player_id", "region", "matches"],
+            db.select([staged_players.c.player_id, region, db.func.count()]).
+               select_from(staged_players.join(matches_table, matches_table.c.match_id == staged_players.c.match_id).
+                                         join(regions_table, regions_table.c.region_id == matches_table.c.server_region_id)).
+               where(new_links).
+               group_by(staged_players.c.player_id, region)
+        )
+    )
+
+    apply_region_counts(staged_counts)
+
+
+def move_region_counts(staged_matches):
+    matches_table = Match.__table__
+    match_players_table = MatchPlayer.__table__
+    old_regions = ServerRegion.__table__.alias("old_regions")
+    new_regions = ServerRegion.__table__.alias("new_regions")
+    old_region = PlayerRegionCount.group_region(old_regions.c.region)
+    new_region = PlayerRegionCount.group_region(new_regions.c.region)
+    linked = match_players_table.join(matches_table, matches_table.c.match_id == match_players_table.c.match_id).\
+                                 join(staged_matches, staged_matches.c.match_id == matches_table.c.match_id)
+
+    # The players of matches moving region leave the old region's count and join the new one's
+    moved_from = db.select([match_players_table.c.player_id, old_region.label("region"), (-db.func.count()).label("matches")]).\
+                    select_from(linked.join(old_regions, old_regions.c.region_id == matches_table.c.server_region_id).
+                                       outerjoin(new_regions, new_regions.c.region_id == staged_matches.c.server_region_id)).\
+                    where(db.or_(new_regions.c.region.is_(None), new_region != old_region)).\
+                    group_by(match_players_table.c.player_id, old_region)
+    moved_to = db.select([match_players_table.c.player_id, new_region.label("region"), db.func.count().label("matches")]).\
+                  select_from(linked.join(new_regions, new_regions.c.region_id == staged_matches.c.server_region_id).
+                                     outerjoin(old_regions, old_regions.c.region_id == matches_table.c.server_region_id)).\
+                  where(db.or_(old_regions.c.region.is_(None), old_region != new_region)).\
+                  group_by(match_players_table.c.player_id, new_region)
+    moves = db.union_all(moved_from, moved_to).alias("moves")
+
+    # Stage the changes to the region counts
+    staged_counts = create_staging_table(db.session, "poll_region_moves",
+                                         db.Column("player_id", UUIDString(), primary_key=True),
+                                         db.Column("region", db.String, primary_key=True),
+                                         db.Column("matches", db.Integer))
+    db.session.execute(
+        staged_counts.insert().from_select(
+            ["player_id", "region", "matches"],
+            db.select([moves.c.player_id, moves.c.region, db.func.sum(moves.c.matches)]).
+               group_by(moves.c.player_id, moves.c.region)
+        )
+    )
+
+    apply_region_counts(staged_counts)
+
+
+def apply_region_counts(staged_counts):
+    counts_table = PlayerRegionCount.__table__
+
+    # Increment existing counts
+    db.session.execute(
+        counts_table.update().
+                     where(counts_table.c.player_id == staged_counts.c.player_id).
+                     where(counts_table.c.region == staged_counts.c.region).
+                     values({counts_table.c.matches: counts_table.c.matches + staged_counts.c.matches})
+    )
+
+    # Add new counts
+    db.session.execute(
+        counts_table.insert().from_select(
+            ["player_id", "region", "matches"],
+            db.select([staged_counts.c.player_id, staged_counts.c.region, staged_counts.c.matches]).
+               where(~db.exists().where(db.and_(counts_table.c.player_id == staged_counts.c.player_id,
+                                                counts_table.c.region == staged_counts.c.region)))
+        )
+    )
+
+
+def expected_region_counts():
+    # Region counts derived from the full match history
+    region = PlayerRegionCount.group_region(ServerRegion.region)
+    return db.select([MatchPlayer.player_id, region.label("region"), db.func.count().label("matches")]).\
+              select_from(MatchPlayer.__table__.join(Match.__table__).join(ServerRegion.__table__)).\
+              group_by(MatchPlayer.player_id, region)
+
+
+def backfill_region_counts():
+    logger.info("[Regions] Rebuilding player region counts")
+    counts_table = PlayerRegionCount.__table__
+
+    # Block polls from incrementing counts while they are rebuilt
+    db.session.execute("LOCK TABLE {0} IN EXCLUSIVE MODE".format(counts_table.name))
+    db.session.execute(counts_table.delete())
+    count = db.session.execute(counts_table.insert().from_select(["player_id", "region", "matches"], expected_region_counts())).rowcount
+    db.session.commit()
 
-    journal.players_updated = len(existing_players)
-    journal.players_added = len(new_players)
+    return count
 
 
-def update_seen_matches(matches, journal):
-    logger.info("[Matches] Updating seen matches")
+def check_region_counts():
+    logger.info("[Regions] Checking player region counts")
+    counts_table = PlayerRegionCount.__table__
+    expected = expected_region_counts()
+    actual = db.select([counts_table.c.player_id, counts_table.c.region, counts_table.c.matches]).\
+                where(counts_table.c.matches != 0)
+
+    # Rows that only appear on one side are inconsistent
+    missing = db.session.execute(expected.except_(actual)).fetchall()
+    unexpected = db.session.execute(actual.except_(expected)).fetchall()
+
+    return missing, unexpected
+
+
+class PlayerDataPrefetcher:
+    """Loads player stats and callsigns for upcoming windows on a thread pool."""
+    def __init__(self, app, workers, callsigns):
+        self.app = app
+        self.callsigns = callsigns
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.futures = {}
+        self.local = threading.local()
+
+    def __call__(self, index, query):
+        ids = [guid for guid, in query.with_entities(Player.player_id)]
+        self.futures[index] = self.executor.submit(self.fetch, ids)
+
+    def fetch(self, ids):
+        # Each worker thread keeps its own app context, and with it its own logged in API client, re-entering it for
+        # every window (g lives on the context, so it is kept between windows)
+        context = getattr(self.local, "context", None)
+        if context is None:
+            context = self.local.context = self.app.app_context()
 
-    # Update existing matches
-    logger.debug("[Matches] Updating existing matches")
-    existing_matches = []
-    for match in Match.query.filter(Match.match_id.in_(matches.keys())):
-        existing_matches.append(match.match_id)
-        match.seen(journal.start)
-        match.load_server_info(matches[match.match_id])
-        db.session.add(match)
-
-        players = matches[match.match_id]["Users"]
-
-        # Update match players
-        if len(players) > 0:
-            # Update existing players
-            existing_players = []
-            for matchplayer in MatchPlayer.query.filter(MatchPlayer.match_id == match.match_id, MatchPlayer.player_id.in_(players)):
-                existing_players.append(matchplayer.player_id)
-                matchplayer.seen(journal.start)
-                db.session.add(matchplayer)
-
-            # Add new players
-            for player in set(players).difference(existing_players):
-                matchplayer = MatchPlayer(match_id=match.match_id, player_id=player)
-                matchplayer.seen(journal.start)
-                db.session.add(matchplayer)
-
-    # Collect new matches
-    new_matches = list(set(matches.keys()).difference(existing_matches))
-
-    # Add new matches
-    logger.debug("[Matches] Adding new matches")
-    for match_id in new_matches:
-        match = Match(match_id=match_id)
-        match.seen(journal.start)
-        match.load_server_info(matches[match.match_id])
-        db.session.add(match)
-
-        # Add match players
-        for player in matches[match.match_id]["Users"]:
-            matchplayer = MatchPlayer(match_id=match.match_id, player_id=player)
-            matchplayer.seen(journal.start)
-            db.session.add(matchplayer)
-
-    journal.matches_updated = len(existing_matches)
-    journal.matches_added = len(new_matches)
+        with context:
+            return set(ids), load_player_data(ids, self.callsigns)
+
+    def result(self, index, players):
+        fetched, (stats, callsigns) = self.futures.pop(index).result()
+
+        # Load any players that moved into the window after it was prefetched
+        missing = [player.player_id for player in players if player.player_id not in fetched]
+        if len(missing) > 0:
+            missing_stats, missing_callsigns = load_player_data(missing, self.callsigns)
+            stats.update(missing_stats)
+            if callsigns is not None:
+                callsigns.update(missing_callsigns)
+
+        return stats, callsigns
+
+    def shutdown(self):
+        for future in self.futures.values():
+            future.cancel()
+        self.executor.shutdown(wait=False)
+
+
+def load_player_data(ids, callsigns=False):
+    if len(ids) == 0:
+        return {}, {} if callsigns else None
+
+    # Load the stats
+    # Using the cache here can fill up the redis backend with player data, so we skip it here.
+    stats = {data["Guid"]: data for data in api_wrapper(lambda: get_api().get_user_stats(ids, cache_skip=True))}
+
+    # Load the callsigns
+    if callsigns:
+        callsigns = api_wrapper(lambda: get_api().get_user_callsign(ids, cache_skip=True))
+    else:
+        callsigns = None
+
+    return stats, callsigns
 
 
 def update_players(last, journal):
@@ -184,70 +516,130 @@ def update_players(last, journal):
 
     if UpdateFlag.all_players in journal.flags:
         last = None
+    update_callsigns = UpdateFlag.update_callsigns in journal.flags
 
-    # Iterate over the players
-    for i, chunk in windowed_query(Player.query, Player.last_seen, current_app.config["TRACKER_BATCH_SIZE"],
-                                   begin=last,
-                                   end=journal.start,
-                                   journal=journal,
-                                   logger=logger,
-                                   logger_prefix="[Players]"):
-        # Update the stats
-        logger.debug("[Players] Updating stats for chunk %d", i + 1)
-        update_player_stats(chunk, journal.start)
+    # Make sure the snapshots have a partition to go into
+    ensure_stats_partition(journal.start)
+    db.session.commit()
+
+    # Setup prefetching of the API data, so the next windows are loaded while the current one is written
+    prefetch_depth = current_app.config["TRACKER_PREFETCH_WINDOWS"]
+    if prefetch_depth > 0:
+        prefetcher = PlayerDataPrefetcher(current_app._get_current_object(), current_app.config["TRACKER_PREFETCH_WORKERS"], update_callsigns)
+    else:
+        prefetcher = None
 
-        # Update the region
-        logger.debug("[Players] Updating regions for chunk %d", i + 1)
-        update_player_regions(chunk)
+    try:
+        # Iterate over the players
+        for i, chunk in windowed_query(Player.query, Player.last_seen, current_app.config["TRACKER_BATCH_SIZE"],
+                                       begin=last,
+                                       end=journal.start,
+                                       journal=journal,
+                                       logger=logger,
+                                       logger_prefix="[Players]",
+                                       clear_session=True,
+                                       prefetch=prefetcher,
+                                       prefetch_depth=prefetch_depth):
+            # Load the API data
+            logger.debug("[Players] Loading data for chunk %d", i + 1)
+            if prefetcher is not None:
+                stats, callsigns = prefetcher.result(i, chunk)
+            else:
+                stats, callsigns = load_player_data([player.player_id for player in chunk], update_callsigns)
+
+            # Update the stats
+            logger.debug("[Players] Updating stats for chunk %d", i + 1)
+            journal.snapshots_skipped += update_player_stats(chunk, stats, journal.start)
 
-        if UpdateFlag.update_callsigns in journal.flags:
-            # Update the callsigns
-            logger.debug("[Players] Updating callsigns for chunk %d", i + 1)
-            journal.callsigns_updated += update_player_callsigns(chunk)
+            # Update the region
+            logger.debug("[Players] Updating regions for chunk %d", i + 1)
+            update_player_regions(chunk)
 
-        journal.players_updated += len(chunk)
+            if update_callsigns:
+                # Update the callsigns
+                logger.debug("[Players] Updating callsigns for chunk %d", i + 1)
+                journal.callsigns_updated += update_player_callsigns(chunk, callsigns)
 
+            journal.players_updated += len(chunk)
+    finally:
+        if prefetcher is not None:
+            prefetcher.shutdown()
 
-def update_player_stats(players, update_time):
-    ids = [player.player_id for player in players]
 
-    # Load the stats
-    # Using the cache here can fill up the redis backend with player data, so we skip it here.
-    stats = {data["Guid"]: data for data in api_wrapper(lambda: get_api().get_user_stats(ids, cache_skip=True))}
+def update_player_stats(players, stats, update_time):
+    ids = [player.player_id for player in players if player.player_id in stats]
+    if len(ids) == 0:
+        return 0
+
+    # Load the hashes of the current snapshots
+    current_hashes = dict(db.session.query(PlayerLatestStats.player_id, PlayerStats.stats_hash).
+                                     join(PlayerStats, PlayerLatestStats.snapshot_join()).
+                                     filter(PlayerLatestStats.player_id.in_(ids)))
 
     # Update players
-    for player in players:
-        if player.player_id in stats:
-            player_stats = PlayerStats(player_id=player.player_id, snapshot_taken=update_time)
-            player_stats.load_stats(stats[player.player_id])
-            db.session.add(player_stats)
+    updated = []
+    rows = []
+    for guid in ids:
+        player_stats = PlayerStats(player_id=guid, snapshot_taken=update_time)
+        player_stats.load_stats(stats[guid])
 
+        # Skip snapshots identical to the current one
+        if guid not in current_hashes or current_hashes[guid] != player_stats.stats_hash:
+            rows.append(player_stats.as_row())
+            updated.append(guid)
 
-def update_player_regions(players):
-    # Iterate through the players
-    for player in players:
-        # Detect most common region
-        regions_query = db.session.query(Match.server_region, db.func.count(Match.server_region)).\
-                                   join(MatchPlayer).\
-                                   filter(MatchPlayer.player_id == player.player_id).\
-                                   group_by(Match.server_region)
-
-        # Group regions
-        regions = {}
-        for region, count in regions_query.all():
-            region = region_groupings.get(region, region)
-            regions[region] = regions.get(region, 0) + count
-
-        if len(regions) > 0:
-            # Update the region
-            player.common_region = max(regions.keys(), key=lambda k: regions[k])
-            db.session.add(player)
+    # Write the snapshots directly, as they are never read back during the update
+    if len(rows) > 0:
+        db.session.execute(PlayerStats.__table__.insert(), rows)
 
+    # Point the players at their new snapshots
+    existing = [guid for guid in updated if guid in current_hashes]
+    if len(existing) > 0:
+        PlayerLatestStats.query.filter(PlayerLatestStats.player_id.in_(existing)).\
+                                update({PlayerLatestStats.snapshot_taken: update_time}, synchronize_session=False)
+    bulk_insert(db.session, PlayerLatestStats.__table__, [{"player_id": guid, "snapshot_taken": update_time}
+                                                          for guid in updated if guid not in current_hashes])
 
-def update_player_callsigns(players):
-    # Load the callsigns
-    callsigns = api_wrapper(lambda: get_api().get_user_callsign([player.player_id for player in players], cache_skip=True))
+    return len(ids) - len(updated)
 
+
+def update_player_regions(players):
+    players = {player.player_id: player for player in players}
+    if len(players) == 0:
+        return
+
+    # Load the region counts of every player in the chunk (already grouped)
+    regions_query = db.session.query(PlayerRegionCount.player_id, PlayerRegionCount.region, PlayerRegionCount.matches).\
+                               filter(PlayerRegionCount.player_id.in_(players.keys()))
+
+    regions = {}
+    for guid, region, count in regions_query:
+        regions.setdefault(guid, {})[region] = count
+
+    # Detect most common region
+    changed = []
+    for guid, player_regions in regions.items():
+        common_region = max(player_regions.keys(), key=lambda k: player_regions[k])
+        if players[guid].common_region != common_region:
+            changed.append({"player_id": guid, "common_region": common_region})
+            # The row is updated below, so keep the loaded player in sync without flushing it
+            set_committed_value(players[guid], "common_region", common_region)
+
+    if len(changed) > 0:
+        # Update the regions
+        players_table = Player.__table__
+        staging = create_staging_table(db.session, "update_regions",
+                                       db.Column("player_id", UUIDString(), primary_key=True),
+                                       db.Column("common_region", db.String))
+        bulk_insert(db.session, staging, changed)
+        db.session.execute(
+            players_table.update().
+                          where(players_table.c.player_id == staging.c.player_id).
+                          values({players_table.c.common_region: staging.c.common_region})
+        )
+
+
+def update_player_callsigns(players, callsigns):
     @CallsignConflictResolver(logger, callsigns)
     def update_callsigns(players, callsigns):
         # Iterate through the players
@@ -269,100 +661,336 @@ def update_matches(last, journal):
         last = None
 
     # Iterate over the matches
-    for _, match in windowed_query(Match.query, Match.last_seen, current_app.config["TRACKER_BATCH_SIZE"],
+    for i, chunk in windowed_query(db.session.query(Match.match_id), Match.last_seen, current_app.config["TRACKER_BATCH_SIZE"],
                                    begin=last,
                                    end=journal.start,
-                                   streaming=True,
                                    journal=journal,
                                    logger=logger,
-                                   logger_prefix="[Matches]"):
+                                   logger_prefix="[Matches]",
+                                   clear_session=True):
         # Update the stats
-        update_match_stats(match, journal.start)
+        logger.debug("[Matches] Updating stats for chunk %d", i + 1)
+        update_match_stats([match_id for match_id, in chunk], journal.start)
+
+        journal.matches_updated += len(chunk)
+
+
+def update_match_stats(match_ids, update_time):
+    if len(match_ids) == 0:
+        return
+
+    # Aggregate the current player stats for the matches
+    stats = db.session.query(MatchPlayer.match_id.label("match_id"),
+                             db.func.avg(PlayerStats.mmr).label("mmr_avg"),
+                             db.func.min(PlayerStats.mmr).label("mmr_min"),
+                             db.func.max(PlayerStats.mmr).label("mmr_max"),
+                             db.func.stddev_samp(PlayerStats.mmr).label("mmr_stddev"),
+                             db.func.avg(PlayerStats.pilot_level).label("pilot_level_avg")).\
+                       join(PlayerLatestStats, PlayerLatestStats.player_id == MatchPlayer.player_id).\
+                       join(PlayerStats, PlayerLatestStats.snapshot_join()).\
+                       filter(MatchPlayer.match_id.in_(match_ids)).\
+                       group_by(MatchPlayer.match_id).\
+                       subquery()
+
+    # Update the match stats
+    # The aggregates ignore null MMRs, and the sample stddev is null with fewer than two. In either case the previous
+    # value is kept.
+    matches_table = Match.__table__
+    db.session.execute(
+        matches_table.update().
+                      where(matches_table.c.match_id == stats.c.match_id).
+                      values({
+                          matches_table.c.mmr_avg: db.func.coalesce(stats.c.mmr_avg, matches_table.c.mmr_avg),
+                          matches_table.c.mmr_min: db.func.coalesce(stats.c.mmr_min, matches_table.c.mmr_min),
+                          matches_table.c.mmr_max: db.func.coalesce(stats.c.mmr_max, matches_table.c.mmr_max),
+                          matches_table.c.mmr_stddev: db.func.coalesce(stats.c.mmr_stddev, matches_table.c.mmr_stddev),
+                          matches_table.c.pilot_level_avg: stats.c.pilot_level_avg,
+                          matches_table.c.last_stats_update: update_time
+                      })
+    )
+
+
+def field_default(target):
+    # Get the default value for the target attribute
+    if target.default is None:
+        return None
+    return target.default.arg
+
+
+def ranking_query(field):
+    # Get the target field and it's default
+    target = getattr(PlayerStats, field)
+    default = field_default(target)
 
-        journal.matches_updated += 1
+    # Rank the players in the database (rank() gives tied scores the same position, skipping the following ones)
+    return db.session.query(PlayerStats.player_id, target, db.func.rank().over(order_by=target.desc())).\
+                      join(PlayerLatestStats, PlayerLatestStats.snapshot_join()).\
+                      join(Player, Player.player_id == PlayerStats.player_id).\
+                      filter(target != default).\
+                      filter(Player.blacklisted.is_(False))
 
 
-def update_match_stats(match, update_time):
-    # Get the player stats for the match
-    stats = db.session.query(PlayerStats.mmr, PlayerStats.pilot_level).\
-                       join(MatchPlayer, PlayerStats.player_id == MatchPlayer.player_id).\
-                       filter(MatchPlayer.match_id == match.match_id).all()
+def full_rankings_due(last, journal):
+    # Incremental rankings need a previous update to work from, and are periodically rebuilt in full as a safety net
+    if not current_app.config["RANKING_INCREMENTAL"] or last is None or UpdateFlag.all_players in journal.flags:
+        return True
 
-    if len(stats) > 0:
-        # Unpack and update match stats
-        mmrs, levels = zip(*stats)
-        match.calculate_stats([mmr for mmr in mmrs if mmr is not None], levels, update_time)
-        db.session.add(match)
+    # The blacklist at the last rankings is needed to pick up the players taken off it since
+    redis = get_redis()
+    rebuilt = redis.get(format_redis_key("rank_rebuild"))
+    if rebuilt is None or not redis.exists(format_redis_key("rank_blacklist")):
+        return True
+
+    rebuilt = datetime.strptime(rebuilt.decode(), "%Y-%m-%dT%H:%M:%S.%f")
+    return (journal.start - rebuilt).total_seconds() >= current_app.config["RANKING_REBUILD_INTERVAL"]
+
+
+class RankingArrays:
+    """The latest stats of every unblacklisted player, loaded in a single pass for ranking all the fields at once."""
+    def __init__(self):
+        columns = [getattr(PlayerStats, field) for field in ranking_fields]
+        query = db.session.query(PlayerStats.player_id, *columns).\
+                           join(PlayerLatestStats, PlayerLatestStats.snapshot_join()).\
+                           join(Player, Player.player_id == PlayerStats.player_id).\
+                           filter(Player.blacklisted.is_(False))
+
+        players = []
+        values = []
+        for row in query.yield_per(current_app.config["TRACKER_BATCH_SIZE"]):
+            players.append(row[0])
+            values.append(row[1:])
+
+        # Missing stats become NaN, which are never ranked
+        self.players = numpy.array(players, dtype=object)
+        self.values = numpy.array(values, dtype=numpy.float64).reshape(len(values), len(ranking_fields))
+
+    def rank(self, field):
+        return rank_scores(field, self.players, self.values[:, ranking_fields.index(field)])
+
+    def save(self, directory):
+        # Write the players and each field's scores as arrays of their own, so ranking workers can map in only the field
+        # they are ranking
+        numpy.save(os.path.join(directory, "players.npy"), self.players.astype("S36"))
+        for index, field in enumerate(ranking_fields):
+            numpy.save(os.path.join(directory, field + ".npy"), numpy.ascontiguousarray(self.values[:, index]))
+
+    @staticmethod
+    def rank_saved(directory, field):
+        players = numpy.load(os.path.join(directory, "players.npy"), mmap_mode="r")
+        scores = numpy.load(os.path.join(directory, field + ".npy"), mmap_mode="r")
+        return rank_scores(field, players, scores)
+
+
+def rank_scores(field, players, scores):
+    # Leave out the players without a score
+    ranked = ~numpy.isnan(scores)
+    default = field_default(getattr(PlayerStats, field))
+    if default is not None:
+        ranked &= scores != default
+    players = players[ranked]
+    scores = scores[ranked]
+
+    # Competition-style ranks, matching rank(): 1 + the number of strictly higher scores
+    ascending = numpy.sort(scores)
+    positions = len(scores) - numpy.searchsorted(ascending, scores, side="right") + 1
+
+    # Order the rows by score, as the ranking query does
+    order = numpy.argsort(-scores, kind="mergesort")
+    players = players[order].tolist()
+    if len(players) > 0 and isinstance(players[0], bytes):
+        players = [player.decode() for player in players]
+    return zip(players, scores[order].tolist(), positions[order].tolist())
+
+
+def rebuild_field_rankings(rankings, rows):
+    batch_size = current_app.config["TRACKER_BATCH_SIZE"]
+
+    # Start building the new rankings (the current ones stay readable until they are replaced)
+    rankings.start()
+
+    # Stream the players into redis
+    total = 0
+    for batch in chunks(rows, batch_size):
+        rankings.store(batch)
+        total += len(batch)
+
+    # Set the total number of ranked players and publish the rankings
+    rankings.finish(total)
+
+
+def update_field_rankings(rankings, field, last, unblacklisted):
+    # Get the target field and it's default
+    target = getattr(PlayerStats, field)
+    default = field_default(target)
+
+    # Load the players with new stats since the last completed update, along with any blacklisted players to remove and
+    # any taken off the blacklist to add back
+    # These are separate parts of a union so each can use it's own index
+    query = db.session.query(PlayerStats.player_id, target, Player.blacklisted).\
+                       join(PlayerLatestStats, PlayerLatestStats.snapshot_join()).\
+                       join(Player, Player.player_id == PlayerStats.player_id)
+    parts = [query.filter(Player.blacklisted.is_(True))]
+    if len(unblacklisted) > 0:
+        parts.append(query.filter(PlayerStats.player_id.in_(unblacklisted)))
+    query = query.filter(PlayerLatestStats.snapshot_taken > last).union(*parts)
+
+    changes = []
+    for player_id, score, blacklisted in query.yield_per(current_app.config["TRACKER_BATCH_SIZE"]):
+        if blacklisted or score is None or score == default:
+            score = None
+        changes.append((player_id, score))
+
+    # Apply the changes on top of the current rankings
+    return rankings.update(changes)
+
+
+class FieldRanker:
+    """Ranks fields one at a time, either rebuilding them in full or applying the scores changed since the last update."""
+    def __init__(self, full, last, unblacklisted, arrays_directory=None):
+        self.full = full
+        self.last = last
+        self.unblacklisted = unblacklisted
+        self.arrays_directory = arrays_directory
+        self.arrays = None
+
+    def __call__(self, field):
+        rankings = get_rankings(field)
+
+        if self.full or not rankings.can_update():
+            logger.debug("[Rankings] Rebuilding global rankings for %s", field)
+            if current_app.config["RANKING_METHOD"] == "vectorized" and self.arrays_directory is not None:
+                # Map in the field's scores saved for the workers
+                rows = RankingArrays.rank_saved(self.arrays_directory, field)
+            elif current_app.config["RANKING_METHOD"] == "vectorized":
+                # Load every field's scores once, and rank them in memory
+                if self.arrays is None:
+                    self.arrays = RankingArrays()
+                rows = self.arrays.rank(field)
+            else:
+                rows = ranking_query(field).yield_per(current_app.config["TRACKER_BATCH_SIZE"])
+            rebuild_field_rankings(rankings, rows)
+        else:
+            logger.debug("[Rankings] Updating global rankings for %s", field)
+            changed = update_field_rankings(rankings, field, self.last, self.unblacklisted)
+            logger.debug("[Rankings] Applied %d changed scores for %s", changed, field)
+
+        return field
+
+
+# Set up in each ranking worker process
+worker_ranker = None
+
+
+def init_ranking_worker(config, full, last, unblacklisted, arrays_directory):
+    global worker_ranker
+
+    # Each worker has it's own app, and with it it's own database and redis connections
+    app = create_app(config_parameters=config)
+    app.app_context().push()
+    worker_ranker = FieldRanker(full, last, unblacklisted, arrays_directory)
+
+
+def rank_field_worker(field):
+    try:
+        return worker_ranker(field)
+    finally:
+        # Don't hold the read transaction open between fields
+        db.session.rollback()
 
 
 def update_global_rankings(last, journal):
     logger.info("[Rankings] Updating global rankings")
+
+    full = full_rankings_due(last, journal)
+    if not full:
+        logger.info("[Rankings] Applying changed scores since %s", last)
+
+    # Players taken off the blacklist since the last rankings have no new stats to be picked up by, so they are added
+    # back explicitly
     redis = get_redis()
+    blacklist_key = format_redis_key("rank_blacklist")
+    blacklisted = {player_id for player_id, in db.session.query(Player.player_id).filter(Player.blacklisted.is_(True))}
+    unblacklisted = sorted({player_id.decode() for player_id in redis.smembers(blacklist_key)} - blacklisted)
+    if not full and len(unblacklisted) > 0:
+        logger.info("[Rankings] Adding back %d players taken off the blacklist", len(unblacklisted))
 
     # Prep journal
     i = journal.stage_start(len(ranking_fields))
     db.session.commit()
 
-    # Latest snapshot filter subquery
-    ps1 = db.aliased(PlayerStats)
-    latest_snapshot = db.session.query(db.func.max(ps1.snapshot_taken)).filter(ps1.player_id == PlayerStats.player_id).subquery()
-
     # Iterate over the rankings
-    for field in ranking_fields[i:]:
-        key = format_redis_key("rank", field)
+    workers = current_app.config["RANKING_WORKERS"]
+    if workers > 0:
+        # Rank the fields in worker processes - results come back in field order, so the checkpoint only ever covers
+        # fields that are complete
+        logger.debug("[Rankings] Ranking with %d workers", workers)
+        with tempfile.TemporaryDirectory(prefix="rankings") as directory:
+            # Load the scores once for every worker, with each only mapping in the field it is ranking
+            arrays_directory = None
+            rebuilding = full or not all(get_rankings(field).can_update() for field in ranking_fields[i:])
+            if current_app.config["RANKING_METHOD"] == "vectorized" and rebuilding:
+                RankingArrays().save(directory)
+                arrays_directory = directory
+
+            context = multiprocessing.get_context("spawn")
+            with context.Pool(workers, init_ranking_worker, (dict(current_app.config), full, last, unblacklisted, arrays_directory)) as pool:
+                for _ in pool.imap(rank_field_worker, ranking_fields[i:]):
+                    i += 1
+                    journal.stage_checkpoint(i)
+                    db.session.commit()
+    else:
+        ranker = FieldRanker(full, last, unblacklisted)
+        for field in ranking_fields[i:]:
+            ranker(field)
 
-        logger.debug("[Rankings] Updating global rankings for %s", field)
+            i += 1
+            journal.stage_checkpoint(i)
+            db.session.commit()
 
-        # Delete old rankings
-        redis.delete(key)
+    # Record when the rankings were last rebuilt in full and the blacklist they now reflect (only kept while incremental,
+    # so enabling it forces a rebuild)
+    if not current_app.config["RANKING_INCREMENTAL"]:
+        redis.delete(format_redis_key("rank_rebuild"), blacklist_key)
+    else:
+        if full:
+            redis.set(format_redis_key("rank_rebuild"), journal.start.strftime("%Y-%m-%dT%H:%M:%S.%f"))
 
-        # Get the target field and it's default
-        target = getattr(PlayerStats, field)
-        if target.default is None:
-            default = target.default
-        else:
-            default = target.default.arg
-
-        # Iterate over the players, building the current field's rankings
-        query = db.session.query(PlayerStats.player_id, target).\
-                           join(Player).\
-                           filter(target != default).\
-                           filter(Player.blacklisted.is_(False)).\
-                           filter(PlayerStats.snapshot_taken == latest_snapshot).\
-                           order_by(target.desc())
-
-        # Setup for the loop
-        index = 0
-        position = 0
-        last = False
-        batch = {}
-        for player, score in query.yield_per(current_app.config["TRACKER_BATCH_SIZE"]):
-            # Update the index and position
-            index += 1
-            if last != score:
-                position = index
-            last = score
-
-            # Set player's position
-            batch[player] = position
-
-            if index % current_app.config["TRACKER_BATCH_SIZE"] == 0:
-                # Save the chunk of players
-                redis.hmset(key, batch)
-                batch = {}
-
-        # Set the total number of ranked players
-        batch["total"] = index
-        redis.hmset(key, batch)
-
-        i += 1
-        journal.stage_checkpoint(i)
-        db.session.commit()
+        pipeline = redis.pipeline(transaction=True)
+        pipeline.delete(blacklist_key)
+        for batch in chunks(sorted(blacklisted), current_app.config["TRACKER_BATCH_SIZE"]):
+            pipeline.sadd(blacklist_key, *batch)
+        pipeline.execute()
 
     journal.global_rankings_updated = True
     db.session.commit()
 
 
+def verify_global_rankings():
+    """Compare the stored global rankings against a full rebuild.
+
+    Returns a dict of field to (mismatched, expected total, stored total) for every inconsistent field, where mismatched
+    is a list of (player, expected rank, stored rank)."""
+    batch_size = current_app.config["TRACKER_BATCH_SIZE"]
+
+    inconsistent = {}
+    for field in ranking_fields:
+        rankings = get_rankings(field)
+
+        mismatched = []
+        expected = 0
+        for batch in chunks(ranking_query(field).yield_per(batch_size), batch_size):
+            stored = rankings.ranks([player for player, _, _ in batch])
+            mismatched.extend((player, position, stored[player]) for player, _, position in batch if stored[player] != position)
+            expected += len(batch)
+
+        # Players left ranked that shouldn't be show up in the total
+        total = rankings.total() or 0
+        if len(mismatched) > 0 or total != expected:
+            inconsistent[field] = (mismatched, expected, total)
+
+    return inconsistent
+
+
 def poll_servers(flags):
     # Prepare journal
     start = datetime.utcnow()
@@ -377,22 +1005,23 @@ def poll_servers(flags):
     db.session.add(journal)
     db.session.commit()
 
+    queries = QueryCounter(db.engine)
     try:
-        with db.session.no_autoflush:
+        with db.session.no_autoflush, queries:
             # Load server list
             journal.stage_next(PollStage.fetch_servers)
             db.session.commit()
-            players, matches = load_server_list(journal)
+            players, matches, previous = load_server_list(journal)
 
             # Update players
             journal.stage_next(PollStage.players)
             db.session.commit()
-            update_seen_players(players, journal)
+            update_seen_players(players, journal, previous)
 
             # Update matches
             journal.stage_next(PollStage.matches)
             db.session.commit()
-            update_seen_matches(matches, journal)
+            update_seen_matches(matches, journal, previous)
 
             # Complete
             journal.stage_next(PollStage.complete)
@@ -411,12 +1040,23 @@ def poll_servers(flags):
         journal.complete(start)
     finally:
         # Commit the journal
+        journal.queries = queries.count
         db.session.commit()
 
+    if journal.status == PollStatus.complete:
+        # Save the server list for the next poll to diff against
+        save_poll_snapshot(players, matches, journal)
+
     return journal
 
 
-def update_tracker(flags):
+def update_tracker(flags, stop=None):
+    # The stop event (if given) is checked between stages, failing the update so it can be resumed (with the resume
+    # flag, which the daemon passes on its next run)
+    def check_stop():
+        if stop is not None and stop.is_set():
+            raise UpdateStopped
+
     # Check for resume flag
     resume = UpdateFlag.resume in flags
     if resume:
@@ -456,6 +1096,7 @@ def update_tracker(flags):
             if journal.stage == UpdateStage.not_started:
                 # Start with players
                 journal.stage_next(UpdateStage.players)
+                check_stop()
 
             if journal.stage == UpdateStage.players:
                 # Update the player data
@@ -464,6 +1105,7 @@ def update_tracker(flags):
                 # Move onto matches
                 journal.stage_next(UpdateStage.matches)
                 db.session.commit()
+                check_stop()
 
             if journal.stage == UpdateStage.matches:
                 # Update the match stats
@@ -472,6 +1114,7 @@ def update_tracker(flags):
                 # Move onto global rankings
                 journal.stage_next(UpdateStage.global_rankings)
                 db.session.commit()
+                check_stop()
 
             if journal.stage == UpdateStage.global_rankings:
                 # Update the global rankings
@@ -480,6 +1123,12 @@ def update_tracker(flags):
                 # Move onto completion
                 journal.stage_next(UpdateStage.complete)
                 db.session.commit()
+    except UpdateStopped:
+        logger.warn("Stopped during stage %s, the update can be resumed with --resume-update (the daemon resumes it on it's next run).", journal.stage.name)
+        db.session.rollback()
+
+        # Record failure
+        journal.fail(start)
     except:
         logger.error("Exception encountered, rolling back...", exc_info=True)
         try:
@@ -493,31 +1142,36 @@ def update_tracker(flags):
         # Record completion
         journal.complete(start)
     finally:
+        # Record the peak memory usage (of the process, so in the daemon this covers every task run so far)
+        journal.peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
         # Commit the journal
         db.session.commit()
 
     return journal
 
 
-def decode_rank(rank):
-    if rank is None:
-        return None
-    return int(rank)
-
-
 def get_global_rank(player, field):
-    redis = get_redis()
-    total = decode_rank(redis.hget(format_redis_key("rank", field), "total"))
+    rankings = get_rankings(field)
+    total = rankings.total()
 
     if isinstance(player, str):
-        return decode_rank(redis.hget(format_redis_key("rank", field), player)), total
+        return rankings.rank(player), total
 
     if len(player) > 0:
-        return {player: decode_rank(rank) for player, rank in zip(player, redis.hmget(format_redis_key("rank", field), player))}, total
+        return rankings.ranks(player), total
 
     return {}, total
 
 
+def get_rank_neighborhood(player, field, size=5):
+    """Get the players ranked around a player, as a list of (player, rank, score) and the total ranked players.
+
+    The list is None if the player is unranked."""
+    rankings = get_rankings(field)
+    return rankings.neighborhood(player, size), rankings.total()
+
+
 def get_ranked_players(field, count, preload=None):
     # Make sure we aren't doing a pointless request
     if count < 1:
@@ -526,14 +1180,9 @@ def get_ranked_players(field, count, preload=None):
     if preload is None:
         preload = []
 
-    # Get the target field
+    # Get the target field and it's default
     target = getattr(PlayerStats, field)
-
-    # Get the default value for the target attribute
-    if target.default is None:
-        default = target.default
-    else:
-        default = target.default.arg
+    default = field_default(target)
 
     # Build the query
     query = Player.query.join(Player.stats).filter(target != default).filter(Player.blacklisted.is_(False))
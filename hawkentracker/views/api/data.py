@@ -7,10 +7,9 @@ from sqlalchemy.orm import contains_eager
 
 from hawkentracker.interface import get_api, get_player_id
 from hawkentracker.tracker import get_ranked_players, get_global_rank
-from hawkentracker.mappings import ranking_fields, region_names, gametype_names, map_names
+from hawkentracker.mappings import ranking_fields, region_names
 from hawkentracker.helpers import parse_serverside
-from hawkentracker.database import Player, Match, MatchPlayer
-from hawkentracker.util import value_or_default
+from hawkentracker.database import Player, Match, MatchPlayer, server_lookups
 from hawkentracker.views.api import api, api_response
 
 
@@ -98,12 +97,18 @@ def player_matches(player):
         data["draw"] = int(draw)
 
     # Determine the sort
-    if order in ("id", "server_name", "server_region", "server_gametype", "server_map", "server_version"):
-        sort = getattr(getattr(Match, order), direction)()
+    query = MatchPlayer.query.join(MatchPlayer.match).filter(MatchPlayer.player_id == guid).options(contains_eager(MatchPlayer.match))
+    if order == "id":
+        sort = getattr(Match.match_id, direction)()
+    elif order in server_lookups:
+        # Sort by the server attribute's value, rather than it's id
+        lookup = server_lookups[order]
+        query = query.join(lookup.table, lookup.id_column == getattr(Match, order + "_id"))
+        sort = getattr(lookup.value_column, direction)()
     else:
         sort = getattr(getattr(MatchPlayer, order), direction)()
 
-    matches = MatchPlayer.query.join(MatchPlayer.match).filter(MatchPlayer.player_id == guid).options(contains_eager(MatchPlayer.match)).order_by(sort).all()
+    matches = query.order_by(sort).all()
 
     for match in matches:
         data["recordsTotal"] += 1
@@ -112,9 +117,9 @@ def player_matches(player):
         item = {
             "id": match.match_id,
             "server_name": match.match.server_name,
-            "server_region": value_or_default(region_names.get(match.match.server_region, None), match.match.server_region),
-            "server_gametype": value_or_default(gametype_names[match.match.server_gametype], match.match.server_gametype),
-            "server_map": value_or_default(map_names[match.match.server_map], match.match.server_map),
+            "server_region": match.match.server_label("server_region"),
+            "server_gametype": match.match.server_label("server_gametype"),
+            "server_map": match.match.server_label("server_map"),
             "server_version": match.match.server_version,
             "first_seen": match.first_seen.strftime("%Y-%m-%d %H:%M"),
             "last_seen": match.last_seen.strftime("%Y-%m-%d %H:%M")
@@ -5,7 +5,6 @@ from flask import Blueprint, flash, render_template
 
 from hawkenapi.util import verify_match
 from hawkentracker.interface import get_api
-from hawkentracker.mappings import region_names, gametype_names, map_names
 from hawkentracker.helpers import to_last, access_denied
 from hawkentracker.database import Match
 
@@ -37,9 +36,9 @@ def view(id):
         "match": {
             "id": match.match_id,
             "server_name": match.server_name,
-            "server_region": region_names.get(match.server_region, match.server_region),
-            "server_gametype": gametype_names.get(match.server_gametype, match.server_gametype),
-            "server_map": map_names.get(match.server_map, match.server_map),
+            "server_region": match.server_label("server_region"),
+            "server_gametype": match.server_label("server_gametype"),
+            "server_map": match.server_label("server_map"),
             "server_version": match.server_version,
             "first_seen": match.first_seen.strftime("%Y-%m-%d %H:%M"),
             "last_seen": match.last_seen.strftime("%Y-%m-%d %H:%M"),
@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Hawken Tracker - Benchmarks
+
+import sys
+import time
+import uuid
+import random
+import tracemalloc
+import argparse
+from datetime import datetime, timedelta
+
+from hawkentracker import create_app
+from hawkentracker.mappings import region_groupings
+
+
+def message(msg):
+    sys.stdout.write(msg + "\n")
+    sys.stdout.flush()
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def seed(db, players, matches, players_per_match, seed_value):
+    from hawkentracker.database import Player, Match, MatchPlayer, server_lookups
+    from hawkentracker.database.util import bulk_insert
+    from hawkentracker.util import chunks
+
+    rng = random.Random(seed_value)
+    now = datetime.utcnow()
+    regions = sorted(region_groupings.keys())
+
+    # Players
+    player_ids = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(players)]
+    for chunk in chunks(player_ids, 10000):
+        bulk_insert(db.session, Player.__table__, [{
+            "player_id": guid,
+            "first_seen": now - timedelta(days=30),
+            "last_seen": now - timedelta(minutes=rng.randrange(43200)),
+            "blacklisted": False
+        } for guid in chunk])
+
+    # Matches
+    match_ids = [uuid.UUID(int=rng.getrandbits(128)).hex for _ in range(matches)]
+    for chunk in chunks(match_ids, 10000):
+        bulk_insert(db.session, Match.__table__, [{
+            "match_id": match_id,
+            "server_name_id": server_lookups["server_name"].id("Benchmark"),
+            "server_region_id": server_lookups["server_region"].id(rng.choice(regions)),
+            "server_gametype_id": server_lookups["server_gametype"].id("HawkenTDM"),
+            "server_map_id": server_lookups["server_map"].id("VS-Alleys"),
+            "server_version_id": server_lookups["server_version"].id("0"),
+            "first_seen": now - timedelta(days=30),
+            "last_seen": now
+        } for match_id in chunk])
+
+    # Match players
+    rows = ({"match_id": match_id, "player_id": guid, "first_seen": now, "last_seen": now}
+            for match_id in match_ids
+            for guid in rng.sample(player_ids, min(players_per_match, players)))
+    for chunk in chunks(rows, 10000):
+        bulk_insert(db.session, MatchPlayer.__table__, chunk)
+
+    db.session.commit()
+
+
+def seed_stats(db, snapshots, seed_value):
+    from hawkentracker.database import Player, PlayerStats, PlayerLatestStats
+    from hawkentracker.database.util import bulk_insert
+    from hawkentracker.util import chunks
+
+    rng = random.Random(seed_value)
+    now = datetime.utcnow()
+
+    # Stats snapshots, with the latest one for each player pointed to
+    rows = []
+    latest = []
+    for guid, in db.session.query(Player.player_id):
+        taken = sorted(now - timedelta(minutes=minutes) for minutes in rng.sample(range(43200), snapshots))
+        for snapshot_taken in taken:
+            rows.append({
+                "player_id": guid,
+                "snapshot_taken": snapshot_taken,
+                "mmr": rng.uniform(1000, 2000),
+                "pilot_level": rng.randrange(1, 31),
+                "time_played": rng.randrange(1000000),
+                "xp": rng.randrange(1000000),
+                "kda": rng.uniform(0, 5),
+                "win_loss": rng.uniform(0, 3)
+            })
+        latest.append({"player_id": guid, "snapshot_taken": taken[-1]})
+
+    for chunk in chunks(rows, 10000):
+        bulk_insert(db.session, PlayerStats.__table__, chunk)
+    for chunk in chunks(latest, 10000):
+        bulk_insert(db.session, PlayerLatestStats.__table__, chunk)
+
+    db.session.commit()
+
+
+def legacy_update_player_regions(players):
+    # Per-player implementation of update_player_regions, kept for comparison
+    from hawkentracker.database import db, Match, MatchPlayer, ServerRegion
+
+    for player in players:
+        regions_query = db.session.query(ServerRegion.region, db.func.count(ServerRegion.region)).\
+                                   join(Match).\
+                                   join(MatchPlayer).\
+                                   filter(MatchPlayer.player_id == player.player_id).\
+                                   group_by(ServerRegion.region)
+
+        regions = {}
+        for region, count in regions_query.all():
+            region = region_groupings.get(region, region)
+            regions[region] = regions.get(region, 0) + count
+
+        if len(regions) > 0:
+            player.common_region = max(regions.keys(), key=lambda k: regions[k])
+            db.session.add(player)
+
+    db.session.flush()
+
+
+def bench_regions(app, args):
+    from hawkentracker.database import db, Player
+    from hawkentracker.tracker import update_player_regions, backfill_region_counts
+    from hawkentracker.util import chunks
+
+    elapsed, _ = timed(backfill_region_counts)
+    message("Backfilled player region counts in {0:.3f}s.".format(elapsed))
+
+    batch_size = app.config["TRACKER_BATCH_SIZE"]
+    windows = list(chunks([guid for guid, in db.session.query(Player.player_id).order_by(Player.last_seen)], batch_size))
+    message("Benchmarking update_player_regions over {0} windows of {1} players.".format(len(windows), batch_size))
+
+    def load_regions():
+        return dict(db.session.query(Player.player_id, Player.common_region))
+
+    def run(func):
+        elapsed = 0
+        for window in windows:
+            players = Player.query.filter(Player.player_id.in_(window)).all()
+            window_elapsed, _ = timed(func, players)
+            elapsed += window_elapsed
+        regions = load_regions()
+        db.session.rollback()
+        return elapsed, regions
+
+    legacy_time, legacy_regions = run(legacy_update_player_regions)
+    message("Per-player queries: {0:.3f}s".format(legacy_time))
+
+    current_time, current_regions = run(update_player_regions)
+    message("Region counts:      {0:.3f}s".format(current_time))
+
+    if legacy_time > 0 and current_time > 0:
+        message("Speedup: {0:.1f}x".format(legacy_time / current_time))
+
+    # Ties between regions may be broken differently, so differences are only reported
+    differences = sum(1 for guid, region in legacy_regions.items() if current_regions.get(guid) != region)
+    message("Players with a different common region: {0}".format(differences))
+
+
+def plan_queries(app):
+    # The hot path queries of the tracker and the data views, built the same way as they are there
+    from hawkentracker.database import db, Player, PlayerStats, PlayerLatestStats, Match, MatchPlayer
+    from hawkentracker.database.util import column_windows
+    from hawkentracker.tracker import field_default
+    from sqlalchemy.orm import contains_eager
+
+    batch_size = app.config["TRACKER_BATCH_SIZE"]
+    end = datetime.utcnow()
+    begin = end - timedelta(hours=1)
+    player_id, = db.session.query(Player.player_id).first()
+
+    player_window, _ = next(column_windows(db.session, Player.last_seen, batch_size, begin=begin, end=end))
+    match_window, _ = next(column_windows(db.session, Match.last_seen, batch_size, begin=begin, end=end))
+    target = PlayerStats.mmr
+
+    return [
+        ("player window boundary", db.session.query(Player.last_seen).filter(Player.last_seen >= begin).
+            filter(Player.last_seen < end).order_by(Player.last_seen).offset(batch_size).limit(1)),
+        ("player window", Player.query.filter(player_window).order_by(Player.last_seen)),
+        ("match window boundary", db.session.query(Match.last_seen).filter(Match.last_seen >= begin).
+            filter(Match.last_seen < end).order_by(Match.last_seen).offset(batch_size).limit(1)),
+        ("match window", db.session.query(Match.match_id).filter(match_window).order_by(Match.last_seen)),
+        ("callsign lookup", Player.query.filter(db.func.lower(Player.callsign) == "benchmark")),
+        ("latest stats", db.session.query(PlayerStats).join(PlayerLatestStats, PlayerLatestStats.snapshot_join()).
+            filter(PlayerLatestStats.player_id == player_id)),
+        ("changed stats", db.session.query(PlayerStats.player_id, target, Player.blacklisted).
+            join(PlayerLatestStats, PlayerLatestStats.snapshot_join()).
+            join(Player, Player.player_id == PlayerStats.player_id).
+            filter(PlayerLatestStats.snapshot_taken > begin)),
+        ("blacklisted players", db.session.query(Player.player_id).filter(Player.blacklisted.is_(True))),
+        ("global leaderboard", Player.query.join(Player.stats).filter(target != field_default(target)).
+            filter(Player.blacklisted.is_(False)).options(contains_eager(Player.stats)).order_by(target.desc()).limit(100)),
+        ("player matches", MatchPlayer.query.join(MatchPlayer.match).filter(MatchPlayer.player_id == player_id).
+            options(contains_eager(MatchPlayer.match)).order_by(MatchPlayer.last_seen.desc()))
+    ]
+
+
+def explain(db, query):
+    # Run EXPLAIN on the query's compiled statement with it's parameters
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    return [line for line, in db.session.connection().execute("EXPLAIN " + str(compiled), compiled.params)]
+
+
+def bench_plans(app, args):
+    from hawkentracker.database import db
+
+    elapsed, _ = timed(seed_stats, db, args.snapshots, args.seed)
+    message("Seeded {0} stats snapshots per player in {1:.3f}s.".format(args.snapshots, elapsed))
+
+    # Give the planner statistics for the seeded tables
+    db.session.execute("ANALYZE")
+    db.session.commit()
+
+    failures = 0
+    for name, query in plan_queries(app):
+        plan = explain(db, query)
+        scans = [line.strip() for line in plan if "Seq Scan" in line]
+        if len(scans) > 0:
+            failures += 1
+            message("FAIL {0}:".format(name))
+            for line in plan:
+                message("    " + line)
+        else:
+            message("ok   {0}".format(name))
+
+    if failures > 0:
+        message("{0} queries fell back to sequential scans.".format(failures))
+        sys.exit(1)
+
+
+def fake_stats(rng, guid):
+    # Raw API stats with enough play time and matches for the derived ratios to be calculated
+    return {
+        "Guid": guid,
+        "MatchMaking.Rating": rng.uniform(1000, 2000),
+        "Progress.Pilot.Level": rng.randrange(1, 31),
+        "TimePlayed": rng.randrange(36000, 1000000),
+        "ExpPoints": rng.randrange(1, 1000000),
+        "HawkenPoints": rng.randrange(1, 100000),
+        "Kills.Total": rng.randrange(100, 10000),
+        "Death.Total": rng.randrange(1, 10000),
+        "Assist.Total": rng.randrange(100, 10000),
+        "Damage.Sustained.Total": rng.uniform(1, 1e7),
+        "Damage.Dealt.Total": rng.uniform(1, 1e7),
+        "GameMode.TDM.TotalMatches": rng.randrange(50, 1000),
+        "GameMode.TDM.Wins": rng.randrange(1, 500),
+        "GameMode.TDM.Losses": rng.randrange(1, 500)
+    }
+
+
+def legacy_update_player_stats(players, stats, update_time):
+    # ORM implementation of update_player_stats (without the unchanged snapshot check), kept for comparison
+    from hawkentracker.database import db, PlayerStats
+
+    for player in players:
+        player_stats = PlayerStats(player_id=player.player_id, snapshot_taken=update_time)
+        player_stats.load_stats(stats[player.player_id])
+        db.session.add(player_stats)
+
+    db.session.flush()
+    return 0
+
+
+def bench_memory(app, args):
+    from hawkentracker.database import db, Player
+    from hawkentracker.tracker import update_player_stats
+    from hawkentracker.util import chunks
+
+    rng = random.Random(args.seed)
+    batch_size = app.config["TRACKER_BATCH_SIZE"]
+    windows = list(chunks([guid for guid, in db.session.query(Player.player_id).order_by(Player.last_seen)], batch_size))
+    message("Benchmarking the stats write path over {0} windows of {1} players.".format(len(windows), batch_size))
+
+    def run(func, clear_session, update_time):
+        # Peak Python allocations while writing every window, as ru_maxrss only ever grows within a process
+        tracemalloc.start()
+        start = time.perf_counter()
+        for window in windows:
+            players = Player.query.filter(Player.player_id.in_(window)).all()
+            func(players, {guid: fake_stats(rng, guid) for guid in window}, update_time)
+            db.session.commit()
+            if clear_session:
+                db.session.expunge_all()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        db.session.expunge_all()
+        return elapsed, peak
+
+    now = datetime.utcnow()
+    legacy_time, legacy_peak = run(legacy_update_player_stats, False, now - timedelta(minutes=1))
+    message("ORM adds, session kept:        {0:.3f}s, peak {1:.1f} MiB".format(legacy_time, legacy_peak / 2 ** 20))
+
+    current_time, current_peak = run(update_player_stats, True, now)
+    message("Core inserts, session cleared: {0:.3f}s, peak {1:.1f} MiB".format(current_time, current_peak / 2 ** 20))
+
+
+benchmarks = {
+    "regions": bench_regions,
+    "plans": bench_plans,
+    "memory": bench_memory
+}
+
+
+def main(app, args):
+    from hawkentracker.database import db, Player
+
+    db.create_all()
+    if db.session.query(Player.player_id).first() is not None:
+        message("Refusing to seed a database that already contains players. Point --database at a scratch database.")
+        sys.exit(1)
+
+    try:
+        message("Seeding {0} players, {1} matches ({2} players per match)...".format(args.players, args.matches, args.players_per_match))
+        elapsed, _ = timed(seed, db, args.players, args.matches, args.players_per_match, args.seed)
+        message("Seeded in {0:.3f}s.".format(elapsed))
+
+        benchmarks[args.benchmark](app, args)
+    finally:
+        db.session.rollback()
+        if not args.keep:
+            db.drop_all()
+
+
+if __name__ == "__main__":
+    # Parse args
+    parser = argparse.ArgumentParser(description="Benchmarks tracker stages against a seeded scratch database.")
+    parser.add_argument("benchmark", choices=sorted(benchmarks.keys()), help="specifies the benchmark to run")
+    parser.add_argument("--database", required=True, help="database URI of an empty scratch database (all tables are dropped afterwards)")
+    parser.add_argument("--players", type=int, default=20000, help="number of players to seed")
+    parser.add_argument("--matches", type=int, default=20000, help="number of matches to seed")
+    parser.add_argument("--players-per-match", type=int, default=12, help="number of players to seed per match")
+    parser.add_argument("--snapshots", type=int, default=3, help="number of stats snapshots to seed per player (plans only)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the generated data")
+    parser.add_argument("--keep", action="store_true", default=False, help="keep the seeded tables afterwards")
+
+    args = parser.parse_args()
+
+    # Create app and enter context
+    app = create_app(config_parameters={"SQLALCHEMY_DATABASE_URI": args.database, "LOG_LEVEL": "ERROR"})
+    with app.app_context():
+        main(app, args)
@@ -5,8 +5,10 @@
 import sys
 import argparse
 
+from flask import current_app
+
 from hawkentracker import create_app
-from hawkentracker.mappings import UpdateFlag, UpdateStatus, PollFlag, PollStatus
+from hawkentracker.mappings import UpdateFlag, UpdateStatus, PollFlag, PollStatus, ExportFlag
 
 
 def message(msg):
@@ -14,7 +16,7 @@ def message(msg):
     sys.stdout.flush()
 
 
-def main(task, verbosity, debug, flags):
+def main(task, verbosity, debug, flags, import_file=None):
     error = False
     if flags is None:
         flags = []
@@ -22,7 +24,12 @@ def main(task, verbosity, debug, flags):
     # Import what we need from within the app context
     from hawkentracker.database import db, PollJournal, UpdateJournal
     from hawkentracker.database.util import dump_queries
-    from hawkentracker.tracker import poll_servers, update_tracker
+    from hawkentracker.tracker import poll_servers, update_tracker, backfill_region_counts, check_region_counts,\
+        verify_global_rankings
+    from hawkentracker.retention import maintain_stats_partitions, compact_stats_history
+    from hawkentracker.export import export_stats
+    from hawkentracker.importer import import_stats
+    from hawkentracker.daemon import TrackerDaemon
 
     try:
         # Perform the task given
@@ -44,6 +51,8 @@ def main(task, verbosity, debug, flags):
                 if verbosity >= 1:
                     message("Updated {0} players and {1} matches.".format(journal.players_updated, journal.matches_updated))
                     message("Added {0} players and {1} matches.".format(journal.players_added, journal.matches_added))
+                if verbosity >= 2:
+                    message("Executed {0} queries.".format(journal.queries))
             elif journal.status == PollStatus.failed:
                 if verbosity >= 1:
                     message("Poll failed! Please see traceback for more information. Rerun poll to retry.")
@@ -62,6 +71,9 @@ def main(task, verbosity, debug, flags):
             if journal.status == UpdateStatus.complete:
                 if verbosity >= 1:
                     message("Updated {0} players and {1} matches.".format(journal.players_updated, journal.matches_updated))
+                if verbosity >= 2:
+                    message("Skipped {0} unchanged stats snapshots.".format(journal.snapshots_skipped))
+                    message("Peak memory usage: {0} KiB.".format(journal.peak_rss))
             elif journal.status == UpdateStatus.failed:
                 if verbosity >= 1:
                     message("Update failed! Please see traceback for more information. Rerun update with resume to retry.")
@@ -72,6 +84,114 @@ def main(task, verbosity, debug, flags):
             if journal.status != UpdateStatus.complete:
                 error = True
 
+        elif task == "daemon":
+            poll_interval = current_app.config["DAEMON_POLL_INTERVAL"]
+            update_interval = current_app.config["DAEMON_UPDATE_INTERVAL"]
+            if verbosity >= 1:
+                message("Starting daemon, polling every {0} seconds.".format(poll_interval))
+                if update_interval:
+                    message("Updating every {0} seconds.".format(update_interval))
+
+            daemon = TrackerDaemon(poll_interval, update_interval,
+                                   poll_flags=[flag for flag in flags if isinstance(flag, PollFlag)],
+                                   update_flags=[flag for flag in flags if isinstance(flag, UpdateFlag) and flag != UpdateFlag.resume])
+            daemon.run()
+
+            if verbosity >= 1:
+                message("Daemon stopped.")
+
+        elif task == "backfill-regions":
+            if verbosity >= 1:
+                message("Rebuilding player region counts from the match history...")
+
+            count = backfill_region_counts()
+
+            if verbosity >= 1:
+                message("Stored {0} region counts.".format(count))
+
+        elif task == "check-regions":
+            missing, unexpected = check_region_counts()
+
+            if len(missing) > 0 or len(unexpected) > 0:
+                message("Player region counts are inconsistent: {0} missing or wrong, {1} unexpected.".format(len(missing), len(unexpected)))
+                if verbosity >= 1:
+                    for player_id, region, matches in missing:
+                        message("Expected: {0} {1} {2}".format(player_id, region, matches))
+                    for player_id, region, matches in unexpected:
+                        message("Found: {0} {1} {2}".format(player_id, region, matches))
+                    message("Run backfill-regions to rebuild the counts.")
+                error = True
+            elif verbosity >= 1:
+                message("Player region counts are consistent.")
+
+        elif task == "verify-rankings":
+            inconsistent = verify_global_rankings()
+
+            if len(inconsistent) > 0:
+                for field, (mismatched, expected, total) in sorted(inconsistent.items()):
+                    message("Rankings for {0} are inconsistent: {1} players ranked differently, {2} ranked (expected {3}).".format(field, len(mismatched), total, expected))
+                    if verbosity >= 1:
+                        for player_id, expected_rank, stored_rank in mismatched:
+                            message("{0}: expected {1}, found {2}".format(player_id, expected_rank, stored_rank))
+                if verbosity >= 1:
+                    message("Run update with --all-players to rebuild the rankings.")
+                error = True
+            elif verbosity >= 1:
+                message("Global rankings are consistent.")
+
+        elif task == "maintain-stats":
+            if verbosity >= 1:
+                message("Maintaining the stats history partitions...")
+
+            downsampled = maintain_stats_partitions()
+
+            if verbosity >= 1:
+                for name, resolution, kept in downsampled:
+                    message("Downsampled {0} to {1} snapshots, keeping {2}.".format(name, resolution.value, kept))
+                message("Downsampled {0} partitions.".format(len(downsampled)))
+
+        elif task == "compact-history":
+            if verbosity >= 1:
+                message("Compacting the stats history...")
+
+            players, moved = compact_stats_history()
+
+            if verbosity >= 1:
+                message("Compacted {0} snapshots for {1} players.".format(moved, players))
+
+        elif task == "export":
+            export_flags = [flag for flag in flags if isinstance(flag, ExportFlag)]
+            if verbosity >= 1:
+                message("Exporting the {0} to {1}...".format("latest stats" if ExportFlag.latest_only in export_flags else "stats history",
+                                                           current_app.config["EXPORT_PATH"]))
+
+            try:
+                written, rows = export_stats(export_flags)
+            except ValueError as e:
+                message("Export failed: {0}".format(e))
+                error = True
+            else:
+                if verbosity >= 1:
+                    message("Exported {0} snapshots in {1} chunks.".format(rows, written))
+
+        elif task == "import":
+            if import_file is None:
+                message("A dump to import must be given with --import-file.")
+                error = True
+            else:
+                if verbosity >= 1:
+                    message("Importing stats snapshots from {0}...".format(import_file))
+
+                try:
+                    read, imported, new_players = import_stats(import_file)
+                except ValueError as e:
+                    message("Import failed: {0}".format(e))
+                    error = True
+                else:
+                    if verbosity >= 1:
+                        message("Imported {0} of {1} snapshots, adding {2} players.".format(imported, read, new_players))
+                        message("Run update with --all-players to rebuild the rankings.")
+
         elif task == "status":
             poll = PollJournal.last()
             successful_poll = PollJournal.last_completed()
@@ -112,15 +232,22 @@ def main(task, verbosity, debug, flags):
 if __name__ == "__main__":
     # Parse args
     parser = argparse.ArgumentParser(description="Tool for managing the tracker (poll servers, update tracker, etc).")
-    parser.add_argument("task", choices=("setup", "poll", "update", "status"), help="specifies the task to perform - 'setup' creates the db, 'poll' updates the matches and player info, 'update' updates the player stats, and 'status' shows the poll and update status")
+    parser.add_argument("task", choices=("setup", "poll", "update", "daemon", "backfill-regions", "check-regions", "verify-rankings", "maintain-stats", "compact-history", "export", "import", "status"), help="specifies the task to perform - 'setup' creates the db, 'poll' updates the matches and player info, 'update' updates the player stats, 'daemon' keeps running polls (and optionally updates) on a schedule, 'backfill-regions' rebuilds the player region counts, 'check-regions' verifies the player region counts against the match history, 'verify-rankings' compares the stored global rankings against a full rebuild, 'maintain-stats' creates the upcoming stats history partitions and downsamples the old ones, 'compact-history' moves the old stats snapshots into the compact per-player history, 'export' writes the stats history as chunked column arrays, 'import' loads stats snapshots from a newline-delimited JSON dump, and 'status' shows the poll and update status")
     parser.add_argument("--verbose", "-v", action="count", default=0, help="increase verbosity and log level")
     parser.add_argument("--debug", action="store_true", default=False, help="enable debug mode (forced to off by default)")
     parser.add_argument("--remote-debug", nargs=2, metavar=('host', 'port'), default=False, help="attach to a remote debugger")
+    parser.add_argument("--poll-interval", type=int, help="seconds between polls in daemon mode")
+    parser.add_argument("--update-interval", type=int, help="seconds between updates in daemon mode (updates are not run by default)")
     parser.add_argument("--empty-matches", dest="flags", action="append_const", const=PollFlag.empty_matches, help="include empty matches in poll data")
+    parser.add_argument("--full-poll", dest="flags", action="append_const", const=PollFlag.full_poll, help="write every player and match instead of only the changes since the last poll")
     parser.add_argument("--resume-update", dest="flags", action="append_const", const=UpdateFlag.resume, help="resumes failed update")
-    parser.add_argument("--all-players", dest="flags", action="append_const", const=UpdateFlag.all_players, help="force updating all players")
+    parser.add_argument("--all-players", dest="flags", action="append_const", const=UpdateFlag.all_players, help="force updating all players (and a full rebuild of the rankings)")
     parser.add_argument("--all-matches", dest="flags", action="append_const", const=UpdateFlag.all_matches, help="force updating all matches")
     parser.add_argument("--update-callsigns", dest="flags", action="append_const", const=UpdateFlag.update_callsigns, help="update callsigns during update")
+    parser.add_argument("--export-path", help="directory to export the stats to")
+    parser.add_argument("--import-file", help="newline-delimited JSON dump of stats snapshots to import ('-' for stdin, optionally gzipped)")
+    parser.add_argument("--latest-only", dest="flags", action="append_const", const=ExportFlag.latest_only, help="only export the latest stats snapshot of each player")
+    parser.add_argument("--incremental", dest="flags", action="append_const", const=ExportFlag.incremental, help="append the snapshots taken since the last export to an existing export")
 
     args = parser.parse_args()
 
@@ -145,7 +272,14 @@ if __name__ == "__main__":
 
     parameters["DEBUG"] = args.debug
 
+    if args.poll_interval is not None:
+        parameters["DAEMON_POLL_INTERVAL"] = args.poll_interval
+    if args.update_interval is not None:
+        parameters["DAEMON_UPDATE_INTERVAL"] = args.update_interval
+    if args.export_path is not None:
+        parameters["EXPORT_PATH"] = args.export_path
+
     # Create app and enter context
     app = create_app(config_parameters=parameters)
     with app.app_context():
-        main(args.task, verbosity=args.verbose, debug=args.debug, flags=args.flags)
+        main(args.task, verbosity=args.verbose, debug=args.debug, flags=args.flags, import_file=args.import_file)